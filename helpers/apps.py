@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+from django.core import checks
+
+
+class HelpersConfig(AppConfig):
+    name = 'helpers'
+
+    def ready(self):
+        from .cache import connect_model_versions
+        from .checks import check_order_by_indexes
+        checks.register(check_order_by_indexes, checks.Tags.models)
+        connect_model_versions()
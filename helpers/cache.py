@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from time import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from .signals import active_changed
+
+_tracked_models = set()
+
+
+class LRUCache(object):
+    """
+    Ограниченный по размеру кеш в памяти процесса
+        При переполнении вытесняются давно не использованные значения
+        timeout - время жизни значения в секундах, None - без ограничения
+    """
+    def __init__(self, maxsize=1000, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires is not None and expires < time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time() + self.timeout if self.timeout else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_values(self, predicate):
+        """
+        Удаляет все значения, для которых predicate(value) истинно
+        """
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _version_key(model):
+    return 'helpers:version:%s' % model._meta.concrete_model._meta.label_lower
+
+
+def _initial_version():
+    return int(time() * 1000)
+
+
+def get_model_version(*models):
+    """
+    Версия данных моделей для построения ключей кеша
+        Меняется при каждом bump_model_version
+    """
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_version(), None)
+        versions.update(cache.get_many(missing))
+    return '.'.join(str(versions.get(key, 0)) for key in keys)
+
+
+def bump_model_version(*models):
+    """
+    Инвалидирует все закешированное по версии моделей
+        Нужно вызывать вручную после queryset.update() и bulk_create()
+    """
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def _bump_model_version_receiver(sender, **kwargs):
+    bump_model_version(sender)
+
+
+def connect_model_versions():
+    """
+    Подключает обновление версии для моделей из настроек,
+    вызывается из HelpersConfig.ready() в каждом процессе
+        settings.HELPERS_CACHE_VERSION_MODELS - список 'app_label.Model',
+        нужен процессам, которые пишут данные, но не импортируют view
+        с кешем (админка, команды импорта, воркеры очередей)
+    """
+    track_model_version(*[apps.get_model(label)
+                          for label in getattr(settings, 'HELPERS_CACHE_VERSION_MODELS', ())])
+
+
+def track_model_version(*models):
+    """
+    Подключает сигналы post_save/post_delete, обновляющие версию моделей
+        Вызывается автоматически для моделей view с ajax_cache_timeout
+        при объявлении класса и для HELPERS_CACHE_VERSION_MODELS
+    """
+    for model in models:
+        if model in _tracked_models:
+            continue
+        uid = 'helpers.cache.version.%s' % model._meta.label_lower
+        post_save.connect(_bump_model_version_receiver, sender=model, dispatch_uid=uid)
+        post_delete.connect(_bump_model_version_receiver, sender=model, dispatch_uid=uid)
+        _tracked_models.add(model)
+
+
+active_changed.connect(_bump_model_version_receiver,
+                       dispatch_uid='helpers.cache.version.active_changed')
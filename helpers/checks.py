@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
+from django.urls import get_resolver
+from .views import OrderedObjectListMixin
+
+
+def _iter_view_classes(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _iter_view_classes(pattern.url_patterns)
+        else:
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if view_class is not None:
+                yield view_class
+
+
+def _get_view_model(view_class):
+    if getattr(view_class, 'model', None) is not None:
+        return view_class.model
+    queryset = getattr(view_class, 'queryset', None)
+    if queryset is not None:
+        return queryset.model
+
+
+def is_indexed(model, field_name):
+    """
+    Есть ли индекс, начинающийся с поля field_name
+    """
+    opts = model._meta
+    if field_name == 'pk':
+        return True
+    try:
+        field = opts.get_field(field_name)
+    except FieldDoesNotExist:
+        return False
+    if field.primary_key or field.unique or field.db_index:
+        return True
+    names = (field.name, getattr(field, 'attname', field.name))
+    for fields in list(opts.index_together) + list(opts.unique_together):
+        if fields and fields[0] in names:
+            return True
+    for index in getattr(opts, 'indexes', ()):
+        if index.fields and index.fields[0].lstrip('-') in names:
+            return True
+    return False
+
+
+def check_order_by_indexes(app_configs=None, **kwargs):
+    """
+    Проверяет, что поля из order_by у OrderedObjectListMixin
+    проиндексированы, иначе сортировка большой таблицы идет
+    без индекса (filesort)
+    """
+    errors = []
+    seen = set()
+    try:
+        view_classes = list(_iter_view_classes(get_resolver().url_patterns))
+    except Exception:
+        return errors
+
+    for view_class in view_classes:
+        if view_class in seen or not issubclass(view_class, OrderedObjectListMixin):
+            continue
+        seen.add(view_class)
+        model = _get_view_model(view_class)
+        if model is None:
+            continue
+        if app_configs is not None and model._meta.app_config not in app_configs:
+            continue
+
+        for value, (ordering, _, _) in view_class.get_order_by_options().items():
+            fields = model._meta.ordering if ordering is None else ordering
+            if not fields:
+                continue
+            field_name = fields[0]
+            if not isinstance(field_name, str):
+                continue
+            field_name = field_name.lstrip('-')
+            if '__' in field_name:
+                hint = 'Сортировка по полю связанной модели не использует индекс %s' % \
+                    model._meta.label
+            elif not is_indexed(model, field_name):
+                hint = 'Добавьте db_index=True или Meta.indexes для %s.%s' % (
+                    model._meta.label, field_name)
+            else:
+                continue
+            errors.append(checks.Warning(
+                '%s.%s: order_by "%s" is not indexed' % (
+                    view_class.__module__, view_class.__name__, value),
+                hint=hint,
+                obj=view_class,
+                id='helpers.W001',
+            ))
+    return errors
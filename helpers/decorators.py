@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
+import threading
+from functools import wraps
+from time import time
+
 from django.conf import settings
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponseBadRequest
+from .fastjson import FastJsonResponse
 from .views import view_or_basicauth
 from .utils import int_convertible
 
@@ -16,7 +21,7 @@ def ajax_view(view_func):
         result = view_func(request, *args, **kwargs)
         if not isinstance(result, dict):
             raise TypeError('Decorated function must return dict instance')
-        return JsonResponse(result)
+        return FastJsonResponse(result, request=request)
     return wrapper
 
 
@@ -24,6 +29,7 @@ def basicauth(view_func):
     """
     Декоратор для view требующей http авторизации
     """
+    @wraps(view_func)
     def wrapper(request, *args, **kwargs):
         return view_or_basicauth(view_func, request, *args, **kwargs)
     return wrapper
@@ -59,6 +65,7 @@ class cached_property(object):
     """
     def __init__(self, method):
         self._method = method
+        self.__doc__ = method.__doc__
 
     def __get__(self, instance, owner):
         if instance is None:
@@ -66,3 +73,119 @@ class cached_property(object):
         value = self._method(instance)
         setattr(instance, self._method.__name__, value)
         return value
+
+    def reset(self, instance):
+        instance.__dict__.pop(self._method.__name__, None)
+
+
+class threadsafe_cached_property(cached_property):
+    """
+    cached_property для объектов, общих для нескольких потоков:
+    значение вычисляется один раз, остальные потоки ждут его
+    на блокировке этого экземпляра
+    """
+    def __init__(self, method):
+        super().__init__(method)
+        self._lock_name = '_%s_lock' % method.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = self._method.__name__
+        lock = instance.__dict__.get(self._lock_name)
+        if lock is None:
+            lock = instance.__dict__.setdefault(self._lock_name, threading.RLock())
+        with lock:
+            if name in instance.__dict__:
+                return instance.__dict__[name]
+            value = self._method(instance)
+            instance.__dict__[name] = value
+            return value
+
+
+class slots_cached_property(object):
+    """
+    cached_property для классов со __slots__
+        Значение хранится в слоте _cached_<имя>, его нужно объявить
+
+    class Point:
+        __slots__ = ('x', 'y', '_cached_length')
+
+        @slots_cached_property
+        def length(self):
+            return math.hypot(self.x, self.y)
+    """
+    def __init__(self, method):
+        self._method = method
+        self._slot = '_cached_%s' % method.__name__
+        self.__doc__ = method.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self._slot)
+        except AttributeError:
+            value = self._method(instance)
+            setattr(instance, self._slot, value)
+            return value
+
+    def __delete__(self, instance):
+        self.reset(instance)
+
+    def reset(self, instance):
+        try:
+            delattr(instance, self._slot)
+        except AttributeError:
+            pass
+
+
+class timed_cached_property(object):
+    """
+    cached_property со временем жизни значения в секундах
+
+    class SomeClass:
+       @timed_cached_property(60)
+       def rates(self):
+           return load_rates()
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def __call__(self, method):
+        self._method = method
+        self._key = '_%s_cache' % method.__name__
+        self.__doc__ = method.__doc__
+        return self
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cached = instance.__dict__.get(self._key)
+        now = time()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        value = self._method(instance)
+        instance.__dict__[self._key] = (value, now + self.ttl)
+        return value
+
+    def __delete__(self, instance):
+        self.reset(instance)
+
+    def reset(self, instance):
+        instance.__dict__.pop(self._key, None)
+
+
+def reset_cached_property(instance, *names):
+    """
+    Сбрасывает закешированные значения свойств по именам,
+    при следующем обращении они будут вычислены заново
+
+    >>> reset_cached_property(t, 'some_prop')
+    """
+    for name in names:
+        descriptor = getattr(type(instance), name, None)
+        if hasattr(descriptor, 'reset'):
+            descriptor.reset(instance)
+        else:
+            raise AttributeError('%s is not a cached property' % name)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import csv
+from functools import wraps
+from xml.sax.saxutils import escape
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+from .fastjson import dumps
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+    'xml': 'application/xml; charset=utf-8',
+}
+
+
+class _Echo(object):
+    """
+    Файл для csv.writer, возвращающий записанную строку
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, header=None, **writer_kwargs):
+    writer = csv.writer(_Echo(), **writer_kwargs)
+    if header:
+        yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_json_lines(rows):
+    for row in rows:
+        yield dumps(row) + b'\n'
+
+
+def iter_xml(rows, root='items', item='item'):
+    """
+    XML из словарей: <root><item><key>value</key>...</item></root>
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<%s>\n' % root
+    for row in rows:
+        yield '<%s>%s</%s>\n' % (item, ''.join(
+            '<%s>%s</%s>' % (key, escape(str(value)), key)
+            for key, value in row.items() if value is not None
+        ), item)
+    yield '</%s>\n' % root
+
+
+def iter_template(objects, template_name, context=None, header='', footer=''):
+    """
+    Каждый объект рендерится шаблоном template_name с переменной object,
+    шаблон компилируется один раз (например, offer в YML выгрузке)
+    """
+    template = get_template(template_name)
+    context = dict(context or {})
+    if header:
+        yield header
+    for obj in objects:
+        context['object'] = obj
+        yield template.render(context)
+    if footer:
+        yield footer
+
+
+def buffered(chunks, size=64 * 1024):
+    """
+    Склеивает мелкие части в блоки около size байт
+    """
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def streaming_response(chunks, export_format, filename=None):
+    response = StreamingHttpResponse(buffered(chunks), content_type=CONTENT_TYPES[export_format])
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+def render_rows(rows, export_format, header=None):
+    if export_format == 'csv':
+        return iter_csv(rows, header)
+    if export_format == 'jsonl':
+        return iter_json_lines(rows)
+    if export_format == 'xml':
+        return iter_xml(rows)
+    raise ValueError('Unknown export format %s' % export_format)
+
+
+def streaming_export(export_format, filename=None, header=None):
+    """
+    Декоратор view, возвращающей итератор строк выгрузки:
+    кортежи для csv, словари для jsonl и xml
+
+    @basicauth
+    @streaming_export('csv', 'products.csv', header=['id', 'title', 'price'])
+    def export(request):
+        return Product.objects.values_list('id', 'title', 'price').iterator(chunk_size=2000)
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            rows = view_func(request, *args, **kwargs)
+            return streaming_response(render_rows(rows, export_format, header),
+                                      export_format, filename)
+        return wrapper
+    return decorator
+
+
+class StreamingExportMixin(object):
+    """
+    Миксин view для потоковой выгрузки queryset
+        Объекты читаются через iterator(chunk_size) (серверный курсор
+        на PostgreSQL) и отдаются клиенту по мере выборки, память не
+        зависит от размера каталога
+
+        export_format - csv, jsonl или xml
+        export_fields - поля для values() / values_list()
+        export_template_name - шаблон одного объекта вместо export_fields
+        export_filename - имя файла для Content-Disposition
+
+    class ProductExportView(BasicAuthMixin, StreamingExportMixin, ListView):
+        model = Product
+        export_fields = ['id', 'title', 'price']
+    """
+    export_format = 'csv'
+    export_fields = None
+    export_template_name = None
+    export_header = ''
+    export_footer = ''
+    export_filename = None
+    export_chunk_size = 2000
+
+    def get_export_queryset(self):
+        return self.get_queryset()
+
+    def get_export_chunks(self):
+        if not self.export_fields and not self.export_template_name:
+            raise ImproperlyConfigured(
+                '%s requires either export_fields or export_template_name'
+                % self.__class__.__name__)
+        queryset = self.get_export_queryset()
+        if self.export_template_name:
+            return iter_template(queryset.iterator(chunk_size=self.export_chunk_size),
+                                 self.export_template_name, {'request': self.request},
+                                 self.export_header, self.export_footer)
+        if self.export_format == 'csv':
+            rows = queryset.values_list(*self.export_fields)
+        else:
+            rows = queryset.values(*self.export_fields)
+        return render_rows(rows.iterator(chunk_size=self.export_chunk_size),
+                           self.export_format, self.export_fields)
+
+    def get(self, request, *args, **kwargs):
+        return streaming_response(self.get_export_chunks(), self.export_format,
+                                  self.export_filename)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+_encoder = DjangoJSONEncoder()
+
+
+def _default(o):
+    return _encoder.default(o)
+
+
+def dumps(data):
+    """
+    JSON в bytes через orjson, если установлен, иначе json
+        Decimal, datetime, date, time, UUID сериализуются так же,
+        как в DjangoJSONEncoder
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    Замена JsonResponse с быстрой сериализацией (dumps)
+        request + gzip_min_length - сжимать ответы длиннее gzip_min_length
+        байт, если клиент поддерживает gzip. По умолчанию порог берется
+        из settings.HELPERS_JSON_GZIP_MIN_LENGTH, None - не сжимать
+    """
+    def __init__(self, data, safe=True, request=None, gzip_min_length=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the '
+                            'safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+        if gzip_min_length is None:
+            gzip_min_length = getattr(settings, 'HELPERS_JSON_GZIP_MIN_LENGTH', None)
+        if request is not None and gzip_min_length is not None:
+            self.gzip(request, gzip_min_length)
+
+    def gzip(self, request, min_length=0):
+        patch_vary_headers(self, ('Accept-Encoding',))
+        if len(self.content) < min_length or self.has_header('Content-Encoding'):
+            return
+        if not _accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return
+        compressed = compress_string(self.content)
+        if len(compressed) < len(self.content):
+            self.content = compressed
+            self['Content-Length'] = str(len(compressed))
+            self['Content-Encoding'] = 'gzip'
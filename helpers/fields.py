@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+from django.db.models.fields.files import FieldFile, ImageFieldFile
+from .utils import generate_content_upload_name
+
+
+class ContentHashFieldFileMixin(object):
+    """
+    Сохраняет файл под именем из хеша содержимого,
+    если такой файл уже есть в хранилище - использует его
+    """
+    def save(self, name, content, save=True):
+        name = generate_content_upload_name(self.instance, name, content,
+                                            self.field.upload_prefix)
+        if self.storage.exists(name):
+            self.name = name
+        else:
+            self.name = self.storage.save(name, content, max_length=self.field.max_length)
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+
+        if save:
+            self.instance.save()
+    save.alters_data = True
+
+
+class ContentHashFieldFile(ContentHashFieldFileMixin, FieldFile):
+    pass
+
+
+class ContentHashImageFieldFile(ContentHashFieldFileMixin, ImageFieldFile):
+    pass
+
+
+class ContentHashFieldMixin(object):
+    """
+    Файловое поле с дедупликацией по содержимому
+        upload_prefix - подпапка как prefix у generate_upload_name
+        Файл может использоваться несколькими объектами,
+        поэтому удалять его через field_file.delete() нельзя
+    """
+    def __init__(self, *args, upload_prefix=None, **kwargs):
+        self.upload_prefix = upload_prefix
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.upload_prefix:
+            kwargs['upload_prefix'] = self.upload_prefix
+        return name, path, args, kwargs
+
+
+class ContentHashFileField(ContentHashFieldMixin, models.FileField):
+    attr_class = ContentHashFieldFile
+
+
+class ContentHashImageField(ContentHashFieldMixin, models.ImageField):
+    attr_class = ContentHashImageFieldFile
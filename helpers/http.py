@@ -1,52 +1,220 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import json
 import pickle
 import os
 import random
-import requests
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import time
+from xml.etree.ElementTree import XMLPullParser
 
+import requests
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from .utils import create_http_session
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 
 class HttpClient(object):
     """
     Обертка над requests использующая куки
+        Соединения переиспользуются (keep-alive пул сессии),
+        куки хранятся в памяти и сбрасываются на диск не чаще
+        раза в COOKIE_FLUSH_INTERVAL секунд и при close()
+
+    with HttpClient() as client:
+        pages = client.get_many(urls, concurrency=10)
+        for offer in client.iter_xml(feed_url, 'offer'):
+            ...
+
+    Потоковые методы (iter_content, iter_lines, download, iter_xml,
+    iter_json_lines, iter_json) не держат ответ в памяти целиком,
+    gzip/deflate распаковываются по мере чтения
     """
     USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:31.0) Gecko/20100101 Firefox/31.0'
     COOKIE_PATH = settings.PROJECT_DIR + '/cache/http_client_cookies.txt'
+    COOKIE_FLUSH_INTERVAL = 30
+    POOL_SIZE = 10
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self):
+    def __init__(self, pool_size=None):
         if not os.path.exists(os.path.dirname(self.COOKIE_PATH)):
             os.makedirs(os.path.dirname(self.COOKIE_PATH))
         self.ip = self._get_ip()
+        self.session = create_http_session(pool_size or self.POOL_SIZE)
+        self.session.headers.update(self.get_headers())
+        cookies = self._get_cookies()
+        if cookies:
+            self.session.cookies.update(cookies)
+        self._flush_lock = threading.Lock()
+        self._flushed_at = time()
+        self._cookies_changed = False
 
-    def get(self, url):
-        if self._get_cookies():
-            response = requests.get(
-                url, cookies=self._get_cookies(), stream=True, headers={
-                    'User-Agent': self.USER_AGENT,
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en,ru-ru;q=0.8,ru;q=0.5,en-us;q=0.3',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Referer': 'http://market.yandex.ru/',
-                    'X-Forwarded-For': self.ip
-                }
-            )
-        else:
-            response = requests.get(
-                url, stream=True, headers={
-                    'User-Agent': self.USER_AGENT,
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en,ru-ru;q=0.8,ru;q=0.5,en-us;q=0.3',
-                    'Accept-Encoding': 'gzip, deflate',
-                    'Referer': 'http://market.yandex.ru/',
-                    'X-Forwarded-For': self.ip
-                }
-            )
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_headers(self):
+        return {
+            'User-Agent': self.USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en,ru-ru;q=0.8,ru;q=0.5,en-us;q=0.3',
+            'Accept-Encoding': 'gzip, deflate',
+            'Referer': 'http://market.yandex.ru/',
+            'X-Forwarded-For': self.ip
+        }
 
+    def get(self, url):
+        response = self.session.get(url)
         if response.status_code == 200:
-            self._set_cookies(response.cookies)
+            self._cookies_changed = True
+            self._flush_cookies()
             return response.text
 
+    @contextmanager
+    def _stream(self, url):
+        with self.session.get(url, stream=True) as response:
+            if response.status_code == 200:
+                self._cookies_changed = True
+                self._flush_cookies()
+                yield response
+            else:
+                yield None
+
+    def iter_content(self, url, chunk_size=None):
+        """
+        Распакованное тело ответа частями по chunk_size байт
+        """
+        with self._stream(url) as response:
+            if response is not None:
+                yield from response.iter_content(chunk_size or self.CHUNK_SIZE)
+
+    def iter_lines(self, url, chunk_size=None, encoding=None):
+        with self._stream(url) as response:
+            if response is not None:
+                if encoding:
+                    response.encoding = encoding
+                yield from response.iter_lines(chunk_size or self.CHUNK_SIZE,
+                                               decode_unicode=True)
+
+    def download(self, url, target=None, chunk_size=None):
+        """
+        Записывает тело ответа в target по мере загрузки
+            target - путь, открытый файл или None - временный файл
+        Возвращает django File, который можно передать в FieldFile.save,
+        или None, если ответ не 200
+        """
+        with self._stream(url) as response:
+            if response is None:
+                return None
+            if isinstance(target, str):
+                f = open(target, 'w+b')
+            elif target is None:
+                f = tempfile.TemporaryFile()
+            else:
+                f = target
+            for chunk in response.iter_content(chunk_size or self.CHUNK_SIZE):
+                f.write(chunk)
+            f.flush()
+            f.seek(0)
+            return File(f, name=os.path.basename(target) if isinstance(target, str) else None)
+
+    def iter_xml(self, url, tag, chunk_size=None):
+        """
+        Потоковый разбор XML, отдает элементы tag по мере загрузки
+            Элемент очищается и удаляется из родителя после обработки,
+            поэтому ссылки на него и его потомков хранить нельзя.
+            Остальные элементы вне tag удаляются так же, память не
+            растет с размером документа
+        """
+        parser = XMLPullParser(events=('start', 'end'))
+        parents = []
+        depth = 0  # вложенность в элементы tag
+        for chunk in self.iter_content(url, chunk_size):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    parents.append(element)
+                    if element.tag == tag:
+                        depth += 1
+                    continue
+                parents.pop()
+                if element.tag == tag:
+                    depth -= 1
+                    yield element
+                if depth:
+                    continue
+                element.clear()
+                if parents:
+                    parents[-1].remove(element)
+        parser.close()
+
+    def iter_json_lines(self, url, chunk_size=None):
+        """
+        Потоковый разбор JSON Lines (один объект на строку)
+        """
+        for line in self.iter_lines(url, chunk_size, encoding='utf-8'):
+            if line:
+                yield json.loads(line)
+
+    def iter_json(self, url, prefix='item'):
+        """
+        Потоковый разбор большого JSON документа через ijson
+            prefix - путь до элементов, например 'offers.item'
+        """
+        if ijson is None:
+            raise ImproperlyConfigured('iter_json requires ijson package')
+        with self._stream(url) as response:
+            if response is not None:
+                response.raw.decode_content = True
+                yield from ijson.items(response.raw, prefix)
+
+    def get_many(self, urls, concurrency=None):
+        """
+        Параллельная загрузка, результаты в порядке urls
+            None для не 200 ответов и ошибок соединения
+        """
+        with ThreadPoolExecutor(max_workers=concurrency or self.POOL_SIZE) as executor:
+            return list(executor.map(self._get_or_none, urls))
+
+    def _get_or_none(self, url):
+        try:
+            # синхронный get, в том числе для AsyncHttpClient
+            return HttpClient.get(self, url)
+        except requests.RequestException:
+            return None
+
+    def close(self):
+        self._flush_cookies(force=True)
+        self.session.close()
+
+    def _flush_cookies(self, force=False):
+        if not self._cookies_changed:
+            return
+        if not force and time() - self._flushed_at < self.COOKIE_FLUSH_INTERVAL:
+            return
+        with self._flush_lock:
+            if self._cookies_changed:
+                self._cookies_changed = False
+                self._flushed_at = time()
+                self._set_cookies(self._copy_cookies())
+
+    def _copy_cookies(self):
+        # другие потоки get_many могут менять куки во время записи
+        jar = self.session.cookies
+        with jar._cookies_lock:
+            return jar.copy()
+
     def _get_cookies(self):
         if os.path.isfile(self.COOKIE_PATH):
             with open(self.COOKIE_PATH, 'rb') as f:
@@ -54,8 +222,50 @@ class HttpClient(object):
         return False
 
     def _set_cookies(self, cookies):
-        with open(self.COOKIE_PATH, 'wb') as f:
-            pickle.dump(cookies, f, 0)
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.COOKIE_PATH))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cookies, f, 0)
+            os.replace(path, self.COOKIE_PATH)
+        except Exception:
+            os.remove(path)
+            raise
 
     def _get_ip(self):
         return '192.168.' + str(random.randint(10, 240)) + '.' + str(random.randint(10, 240))
+
+
+class AsyncHttpClient(HttpClient):
+    """
+    asyncio вариант HttpClient
+        Запросы выполняются в пуле потоков поверх той же сессии
+
+    async with AsyncHttpClient() as client:
+        pages = await client.get_many(urls, concurrency=10)
+    """
+    def __init__(self, pool_size=None):
+        super().__init__(pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size or self.POOL_SIZE)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def get(self, url):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, super().get, url)
+
+    async def get_many(self, urls, concurrency=None):
+        semaphore = asyncio.Semaphore(concurrency or self.POOL_SIZE)
+
+        async def get(url):
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, self._get_or_none, url)
+        return await asyncio.gather(*[get(url) for url in urls])
+
+    def close(self):
+        super().close()
+        self._executor.shutdown(wait=False)
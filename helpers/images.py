@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+    'GIF': '.gif',
+}
+
+
+def get_rendition_name(name, key, image_format=None):
+    """
+    Путь к уменьшенной копии рядом с оригиналом
+        app/model/ab/cd/abcd...ef.jpg -> app/model/ab/cd/abcd...ef_small.webp
+    """
+    base, ext = os.path.splitext(name)
+    if image_format:
+        ext = EXTENSIONS.get(image_format.upper(), '.' + image_format.lower())
+    return '%s_%s%s' % (base, key, ext)
+
+
+def parse_rendition(options):
+    width, height = options[:2]
+    return width, height, options[2] if len(options) > 2 else None
+
+
+def generate_renditions(storage, name, renditions, force=True):
+    """
+    Создает уменьшенные копии изображения
+        renditions - {'small': (200, 200), 'small_webp': (200, 200, 'WEBP')}
+        force - перезаписать уже существующие копии
+    """
+    from PIL import Image
+
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+
+    for key, options in renditions.items():
+        width, height, image_format = parse_rendition(options)
+        target = get_rendition_name(name, key, image_format)
+        exists = storage.exists(target)
+        if exists and not force:
+            continue
+
+        image_format = (image_format or image.format or 'JPEG').upper()
+        rendition = image.copy()
+        rendition.thumbnail((width, height), Image.LANCZOS)
+        if image_format == 'JPEG' and rendition.mode not in ('RGB', 'L'):
+            rendition = rendition.convert('RGB')
+        buffer = BytesIO()
+        rendition.save(buffer, image_format, quality=85)
+
+        if exists:
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def delete_unused_renditions(model, field_name, name, renditions):
+    """
+    Удаляет уменьшенные копии изображения name, если оно
+    не используется другими объектами model
+    """
+    if model._default_manager.filter(**{field_name: name}).exists():
+        return
+    storage = model._meta.get_field(field_name).storage
+    for key, options in renditions.items():
+        storage.delete(get_rendition_name(name, key, parse_rendition(options)[2]))
+
+
+def generate_queryset_renditions(queryset, field_name='image', renditions=None, workers=4,
+                                 processes=False, force=False):
+    """
+    Параллельно создает копии изображений для всех объектов queryset
+        processes - пул процессов вместо потоков (для больших объемов,
+            хранилище должно сериализоваться pickle)
+        Ошибки отдельных файлов пишутся в лог и не прерывают обработку
+        Возвращает (количество обработанных изображений, количество ошибок)
+    """
+    model = queryset.model
+    field = model._meta.get_field(field_name)
+    renditions = renditions or getattr(model, '%s_renditions' % field_name)
+    names = queryset.exclude(
+        Q(**{'%s__isnull' % field_name: True}) | Q(**{field_name: ''})
+    ).values_list(field_name, flat=True).iterator()
+
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        futures = {
+            executor.submit(generate_renditions, field.storage, name, renditions, force): name
+            for name in names
+        }
+        failed = 0
+        for future, name in futures.items():
+            try:
+                future.result()
+            except Exception:
+                failed += 1
+                logger.exception('Failed to generate renditions for %s', name)
+    return len(futures) - failed, failed
@@ -1,42 +1,165 @@
 # -*- coding: utf-8 -*-
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-# TODO: заменить на get_user_model
-from django.contrib.auth.models import User
+import logging
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db.models.signals import post_save, post_delete
+from django.template.loader import get_template
 from django.conf import settings
+from .tasks import run_in_background
 
+logger = logging.getLogger(__name__)
 
-def send_mail_notification(action, subject, context, admin=True, recipient=None, html=False):
-    """
-    Отправка email
-        Шаблоны для администратора должны лежать mail/admin/<action>.<html/txt>
-        Шаблоны для пользователя должны лежать mail/user/<action>.<html/txt>
+ADMIN_EMAILS_KEY = 'helpers:mail:admin_emails'
+ADMIN_EMAILS_TIMEOUT = 60 * 60
 
-        action - название события
-        subject - тема сообщения
-        admin - сообщение для админа
-        recipient – список получателей
-        html - является ли сообщениt html
+_templates = {}
+
+
+def get_admin_emails():
     """
-    if not isinstance(recipient, (list, tuple)):
-        recipient = [recipient]
-    if admin:
-        recipient = User.objects.filter(
+    Email суперпользователей, кешируется до изменения пользователей
+    """
+    emails = cache.get(ADMIN_EMAILS_KEY)
+    if emails is None:
+        emails = list(get_user_model().objects.filter(
             is_superuser=True
-        ).values_list('email', flat=True)
+        ).values_list('email', flat=True))
+        cache.set(ADMIN_EMAILS_KEY, emails, ADMIN_EMAILS_TIMEOUT)
+    return emails
+
+
+def _clear_admin_emails(sender, **kwargs):
+    cache.delete(ADMIN_EMAILS_KEY)
+
 
+post_save.connect(_clear_admin_emails, sender=settings.AUTH_USER_MODEL,
+                  dispatch_uid='helpers.mail.admin_emails')
+post_delete.connect(_clear_admin_emails, sender=settings.AUTH_USER_MODEL,
+                    dispatch_uid='helpers.mail.admin_emails')
+
+
+def get_mail_template(action, admin=True, html=False):
+    """
+    Скомпилированный шаблон письма, кешируется если не DEBUG
+    """
     template_name = 'mail/%s/%s.%s' % (
         'admin' if admin else 'user',
         action,
         'html' if html else 'txt'
     )
+    if settings.DEBUG:
+        return get_template(template_name)
+    if template_name not in _templates:
+        _templates[template_name] = get_template(template_name)
+    return _templates[template_name]
+
+
+def build_mail_notification(action, subject, context, admin=True, recipient=None, html=False):
+    """
+    Формирует письмо (EmailMessage), параметры как у send_mail_notification
+    """
+    if not isinstance(recipient, (list, tuple)):
+        recipient = [recipient]
+    if admin:
+        recipient = get_admin_emails()
 
     msg = EmailMessage(
         subject,
-        render_to_string(template_name, context),
+        get_mail_template(action, admin, html).render(context),
         settings.DEFAULT_FROM_EMAIL,
         recipient
     )
     if html:
         msg.content_subtype = 'html'
-    msg.send()
+    return msg
+
+
+def _close_connection(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.warning('Failed to close email connection', exc_info=True)
+
+
+def send_messages(messages, retries=3, backoff=1, connection=None):
+    """
+    Отправляет письма через одно соединение
+        При ошибке отправки или подключения соединение переоткрывается
+        и письмо отправляется повторно с паузой backoff * 2^n секунд
+        Возвращает количество отправленных писем
+    """
+    connection = connection or get_connection()
+    sent = 0
+    opened = False
+    try:
+        for message in messages:
+            for attempt in range(retries + 1):
+                try:
+                    if not opened:
+                        connection.open()
+                        opened = True
+                    sent += connection.send_messages([message]) or 0
+                    break
+                except Exception:
+                    opened = False
+                    _close_connection(connection)
+                    if attempt == retries:
+                        logger.exception('Failed to send email to %s', message.to)
+                        break
+                    time.sleep(backoff * 2 ** attempt)
+    finally:
+        _close_connection(connection)
+    return sent
+
+
+def _build_mail_notifications(action, subject, items, admin, html):
+    for context, recipient in items:
+        try:
+            yield build_mail_notification(action, subject, context, admin, recipient, html)
+        except Exception:
+            logger.exception('Failed to build email %s for %s', action, recipient)
+
+
+def _send_mail_notifications(action, subject, items, admin, html):
+    return send_messages(_build_mail_notifications(action, subject, items, admin, html))
+
+
+def send_mail_notification(action, subject, context, admin=True, recipient=None, html=False,
+                           background=False):
+    """
+    Отправка email
+        Шаблоны для администратора должны лежать mail/admin/<action>.<html/txt>
+        Шаблоны для пользователя должны лежать mail/user/<action>.<html/txt>
+
+        action - название события
+        subject - тема сообщения
+        admin - сообщение для админа
+        recipient – список получателей
+        html - является ли сообщениt html
+        background - отправить в фоне (helpers.tasks), не блокируя запрос
+    """
+    if background:
+        return run_in_background(_send_mail_notifications, action, subject,
+                                 [(context, recipient)], admin, html)
+    build_mail_notification(action, subject, context, admin, recipient, html).send()
+
+
+def send_mass_mail_notification(action, subject, items, admin=False, html=False,
+                                background=True):
+    """
+    Массовая отправка писем одного события через одно соединение
+        items - список пар (context, recipient)
+        background - рендеринг и отправка в фоне (helpers.tasks)
+
+    Использование:
+        send_mass_mail_notification('order', 'Ваш заказ', [
+            ({'order': order}, order.email) for order in orders
+        ])
+    """
+    items = list(items)
+    if background:
+        return run_in_background(_send_mail_notifications, action, subject, items, admin, html)
+    return _send_mail_notifications(action, subject, items, admin, html)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from helpers.images import generate_queryset_renditions
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии изображений для моделей с ImageMixin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--field', default='image')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Пул процессов вместо потоков')
+        parser.add_argument('--force', action='store_true',
+                            help='Перезаписать существующие копии')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not getattr(model, '%s_renditions' % options['field'], None):
+            raise CommandError('%s has no %s_renditions' % (options['model'], options['field']))
+        processed, failed = generate_queryset_renditions(
+            model._default_manager.all(), options['field'], workers=options['workers'],
+            processes=options['processes'], force=options['force'])
+        self.stdout.write('Processed: %s, failed: %s' % (processed, failed))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from helpers.youtube import backfill_youtube_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Загружает превью видео для моделей с YouTubeMixin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--force', action='store_true',
+                            help='Перезагрузить превью у всех объектов')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        updated, failed = backfill_youtube_thumbnails(
+            model._default_manager.all(), options['workers'], options['force'])
+        self.stdout.write('Updated: %s, failed: %s' % (updated, failed))
@@ -1,23 +1,81 @@
 # -*- coding: utf-8 -*-
+import os
+from hashlib import md5
+from time import time
 from django.views.generic import View
-from django.http import Http404
-from django.shortcuts import render_to_response
+from django.http import Http404, HttpResponse
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from ..cache import LRUCache
+
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
 
 
 class TemplateView(View):
     """
     Выводить сырой шаблон
         по url соответствующему иерархии папок
+
+        Найденные шаблоны компилируются один раз и перечитываются
+        при изменении своего файла (изменения в extends / include не
+        отслеживаются), отсутствующие запоминаются на missing_timeout
+        секунд
+        cache_response - хранить отрендеренную страницу в памяти и
+            отвечать 304 по ETag / Last-Modified от времени изменения
+            файла шаблона
     """
+    cache_response = False
+    missing_timeout = 10
+    templates = LRUCache(1000)
+    missing = LRUCache(1000)
+
     def get_template_name(self):
+        template_name = '%s.html' % self.kwargs['template_name']
+        self.template_entry = self.get_template_entry(template_name)
+        return template_name
+
+    def get_template_entry(self, template_name):
+        """
+        {'template': ..., 'mtime': ..., 'content': ...} или Http404
+        """
+        if self.missing.get(template_name, 0) > time():
+            raise Http404
+        entry = self.templates.get(template_name)
+        if entry is not None and _get_mtime(entry['path']) == entry['mtime']:
+            return entry
+
         try:
-            template_name = '%s.html' % self.kwargs['template_name']
-            get_template(template_name)
-            return template_name
+            template = get_template(template_name)
         except TemplateDoesNotExist:
+            self.missing.set(template_name, time() + self.missing_timeout)
             raise Http404
+        path = getattr(getattr(template, 'origin', None), 'name', None)
+        entry = {'template': template, 'path': path, 'mtime': _get_mtime(path), 'content': None}
+        self.templates.set(template_name, entry)
+        return entry
 
     def get(self, request, *args, **kwargs):
-        return render_to_response(self.get_template_name())
+        template_name = self.get_template_name()
+        entry = self.template_entry
+        if not self.cache_response or entry['mtime'] is None:
+            return HttpResponse(entry['template'].render())
+
+        last_modified = int(entry['mtime'])
+        etag = quote_etag(
+            md5(('%s:%s' % (template_name, entry['mtime'])).encode('utf8')).hexdigest())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+        if entry['content'] is None:
+            entry['content'] = entry['template'].render()
+        response = HttpResponse(entry['content'])
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -1,22 +1,97 @@
 # -*- coding: utf-8 -*-
-import requests
-
+import threading
+from collections import Counter
+from copy import deepcopy
 from datetime import datetime
-from django.db import models
+from functools import reduce
+from operator import or_
+from time import time
+from django.core.cache import cache
+from django.db import models, router, transaction
+from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_save, post_delete
 from autoslug import AutoSlugField
-from django.core.files.base import ContentFile
-from .utils import generate_upload_name
+from autoslug.utils import crop_slug, get_prepopulated_value
+from .cache import LRUCache, get_model_version, track_model_version
+from .images import (delete_unused_renditions, generate_renditions, get_rendition_name,
+                     parse_rendition)
+from .signals import active_changed
+from .tasks import run_in_background
+from .utils import generate_upload_name, normalize_phone, normalize_phones
+from .youtube import get_youtube_id, update_youtube_thumbnail
+
+
+def iter_pk_chunks(queryset, chunk_size):
+    """
+    Списки pk queryset по chunk_size штук, по диапазонам pk без OFFSET
+    """
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        chunk = list((queryset if last is None else queryset.filter(pk__gt=last))[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
 
 
 class ActivatableQuerySet(models.QuerySet):
+    """
+    Массовые activate() / deactivate() / sync_active() обновляют только
+    строки, у которых меняется состояние, пачками по chunk_size,
+    каждая пачка в своей транзакции. После каждой пачки отправляется
+    helpers.signals.active_changed со списком pk
+    """
+    chunk_size = 1000
+
     def active(self):
         return self.filter(active=True)
 
-    def activate(self):
-        return self.update(active=True)
+    def activate(self, chunk_size=None):
+        return self._set_active(True, chunk_size)
+
+    def deactivate(self, chunk_size=None):
+        return self._set_active(False, chunk_size)
 
-    def deactivate(self):
-        return self.update(active=False)
+    def sync_active(self, pks, chunk_size=None):
+        """
+        Активными в queryset остаются только объекты с pk из pks
+            pks могут быть строками (из фида или POST)
+            Возвращает количество измененных строк
+        """
+        chunk_size = chunk_size or self.chunk_size
+        to_python = self.model._meta.pk.to_python
+        pks = {to_python(pk) for pk in pks}
+        deactivate = []
+        for chunk in iter_pk_chunks(self.filter(active=True), chunk_size):
+            deactivate.extend(pk for pk in chunk if pk not in pks)
+        updated = self._update_active(deactivate, False, chunk_size)
+
+        activate = []
+        ordered = sorted(pks)
+        for i in range(0, len(ordered), chunk_size):
+            activate.extend(self.filter(
+                pk__in=ordered[i:i + chunk_size], active=False
+            ).values_list('pk', flat=True))
+        return updated + self._update_active(activate, True, chunk_size)
+
+    def _set_active(self, active, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        updated = 0
+        for chunk in iter_pk_chunks(self.exclude(active=active), chunk_size):
+            updated += self._update_active(chunk, active, chunk_size)
+        return updated
+
+    def _update_active(self, pks, active, chunk_size):
+        updated = 0
+        manager = self.model._base_manager.db_manager(self.db)
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            with transaction.atomic(using=self.db):
+                updated += manager.filter(pk__in=chunk).update(active=active)
+            active_changed.send(sender=self.model, pks=chunk, active=active)
+        return updated
 
 
 class ActivatableManager(models.Manager):
@@ -26,11 +101,65 @@ class ActivatableManager(models.Manager):
     def active(self):
         return self.get_queryset().active()
 
-    def activate(self):
-        return self.get_queryset().activate()
+    def activate(self, chunk_size=None):
+        return self.get_queryset().activate(chunk_size)
+
+    def deactivate(self, chunk_size=None):
+        return self.get_queryset().deactivate(chunk_size)
+
+    def sync_active(self, pks, chunk_size=None):
+        return self.get_queryset().sync_active(pks, chunk_size)
+
+
+_active_local_cache = {}
+
+
+class CachedActivatableManager(ActivatableManager):
+    """
+    ActivatableManager с кешем активных объектов для небольших
+    справочников (категории, баннеры, пункты меню)
+        active_cached() / active_pks_cached() не делают запросов в БД:
+        копия хранится в памяти процесса (local_timeout секунд без
+        проверки) и в django cache. Кеш сбрасывается по версии модели
+        (helpers.cache) при save/delete и массовых activate()/deactivate()
+        Возвращаемые объекты общие для всех запросов, их нельзя изменять
+
+    class Category(ActivatableMixin):
+        objects = CachedActivatableManager()
+    """
+    cache_timeout = 60 * 60
+    local_timeout = 5
+
+    def contribute_to_class(self, cls, name):
+        super().contribute_to_class(cls, name)
+        if not cls._meta.abstract:
+            track_model_version(cls)
+
+    def active_cached(self):
+        return list(self._get_cached('objects', lambda: list(self.active())))
+
+    def active_pks_cached(self):
+        return self._get_cached(
+            'pks', lambda: frozenset(self.active().values_list('pk', flat=True)))
+
+    def _get_cached(self, kind, fetch):
+        now = time()
+        local_key = (self.model._meta.label_lower, self._db, kind)
+        local = _active_local_cache.get(local_key)
+        if local is not None and local[0] > now:
+            return local[2]
 
-    def deactivate(self):
-        return self.get_queryset().deactivate()
+        version = get_model_version(self.model)
+        if local is not None and local[1] == version:
+            value = local[2]
+        else:
+            key = 'helpers:active:%s:%s:%s:%s' % (local_key + (version,))
+            value = cache.get(key)
+            if value is None:
+                value = fetch()
+                cache.set(key, value, self.cache_timeout)
+        _active_local_cache[local_key] = (now + self.local_timeout, version, value)
+        return value
 
 
 class ActivatableMixin(models.Model):
@@ -44,16 +173,103 @@ class ActivatableMixin(models.Model):
     class Meta:
         abstract = True
 
+    def activate(self, commit=True):
+        self.active = True
+        if commit:
+            self._save_active()
+
     def deactivate(self, commit=True):
         self.active = False
         if commit:
+            self._save_active()
+
+    def _save_active(self):
+        if self._state.adding:
             self.save()
+        else:
+            self.save(update_fields=['active'])
 
 
 class SortableQuerySet(models.QuerySet):
+    """
+    Перестановка объектов для drag-and-drop
+        Между соседями оставляется зазор sort_gap, поэтому move()
+        обычно обновляет одну строку. Когда зазора нет, список
+        перенумеровывается одним bulk_update
+
+    Category.objects.filter(parent=parent).move(category, after=other)
+    Category.objects.filter(parent=parent).reorder(request.POST.getlist('pk'))
+    """
+    sort_gap = 10
+    sort_max = 32767
+
     def order_by_sort(self):
         return self.order_by('sort')
 
+    def move(self, obj, before=None, after=None):
+        """
+        Ставит obj перед before или после after
+            Возвращает количество обновленных строк
+        """
+        if (before is None) == (after is None):
+            raise ValueError('Specify either before or after')
+        others = self.exclude(pk=obj.pk).order_by('sort', 'pk')
+        if before is not None:
+            low = others.filter(
+                Q(sort__lt=before.sort) | Q(sort=before.sort, pk__lt=before.pk)
+            ).order_by('-sort', '-pk').values_list('sort', flat=True).first()
+            low, high = -1 if low is None else low, before.sort
+        else:
+            high = others.filter(
+                Q(sort__gt=after.sort) | Q(sort=after.sort, pk__gt=after.pk)
+            ).values_list('sort', flat=True).first()
+            low, high = after.sort, self.sort_max + 1 if high is None else high
+
+        if high - low > 1:
+            if high > self.sort_max:
+                sort = min(low + self.sort_gap, self.sort_max)
+            elif low < 0:
+                sort = max(high - self.sort_gap, 0)
+            else:
+                sort = (low + high) // 2
+            obj.sort = sort
+            return self.model._base_manager.db_manager(self.db).filter(
+                pk=obj.pk).update(sort=sort)
+
+        current = list(others.values_list('pk', 'sort'))
+        pks = [pk for pk, _ in current]
+        anchor = before if before is not None else after
+        pks.insert(pks.index(anchor.pk) + (0 if before is not None else 1), obj.pk)
+        sorts = dict(current)
+        sorts[obj.pk] = obj.sort
+        updated, sorts = self._renumber(pks, sorts)
+        obj.sort = sorts[obj.pk]
+        return updated
+
+    def reorder(self, pks):
+        """
+        Расставляет объекты queryset в порядке pks, остальные
+        объекты идут следом в текущем порядке
+            Возвращает количество обновленных строк
+        """
+        current = list(self.order_by('sort', 'pk').values_list('pk', 'sort'))
+        sorts = dict(current)
+        to_python = self.model._meta.pk.to_python
+        pks = [pk for pk in (to_python(pk) for pk in pks) if pk in sorts]
+        listed = set(pks)
+        updated, _ = self._renumber(pks + [pk for pk, _ in current if pk not in listed], sorts)
+        return updated
+
+    def _renumber(self, pks, sorts):
+        gap = min(self.sort_gap, self.sort_max // (len(pks) + 1))
+        if gap < 1:
+            raise ValueError('Too many objects to fit into sort field')
+        new_sorts = {pk: (i + 1) * gap for i, pk in enumerate(pks)}
+        changed = [self.model(pk=pk, sort=sort) for pk, sort in new_sorts.items()
+                   if sorts.get(pk) != sort]
+        self.model._base_manager.db_manager(self.db).bulk_update(changed, ['sort'])
+        return len(changed), new_sorts
+
 
 class SortableMixin(models.Model):
     """
@@ -69,19 +285,136 @@ class SortableMixin(models.Model):
         abstract = True
 
 
+class BulkAutoSlugField(AutoSlugField):
+    """
+    AutoSlugField, который не проверяет уникальность slug,
+    уже выделенного через allocate_slugs()
+        В миграциях остается AutoSlugField
+    """
+    def pre_save(self, instance, add):
+        value = getattr(instance, self.attname)
+        if value and value == getattr(instance, '_allocated_slug', None):
+            return value
+        return super().pre_save(instance, add)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'autoslug.fields.AutoSlugField', args, kwargs
+
+
+def allocate_slugs(objs, field_name='slug', chunk_size=500):
+    """
+    Заполняет уникальные slug для bulk_create без запроса на каждый объект
+        Slug-и строятся как в AutoSlugField, занятые slug-и выбираются
+        пачками одним запросом на chunk_size объектов, суффиксы -2, -3...
+        подбираются в памяти. Параллельный импорт в ту же таблицу может
+        привести к IntegrityError
+
+    Product.objects.bulk_create(allocate_slugs(products))
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    model = objs[0].__class__
+    field = model._meta.get_field(field_name)
+    manager = model._default_manager
+    sep = getattr(field, 'index_sep', '-')
+
+    slugs = []
+    for obj in objs:
+        value = getattr(obj, field.attname) or get_prepopulated_value(field, obj)
+        slug = field.slugify(value) if value else ''
+        slugs.append(crop_slug(field, slug or model._meta.model_name))
+
+    used = set()
+    counts = Counter(slugs)
+    unique = list(counts)
+    repeated = set(slug for slug, count in counts.items() if count > 1)
+    for i in range(0, len(unique), chunk_size):
+        used.update(manager.filter(**{
+            '%s__in' % field_name: unique[i:i + chunk_size]
+        }).values_list(field_name, flat=True))
+    taken = sorted(used | repeated)
+    for i in range(0, len(taken), chunk_size):
+        used.update(manager.filter(reduce(or_, [
+            Q(**{'%s__startswith' % field_name: slug + sep}) for slug in taken[i:i + chunk_size]
+        ])).values_list(field_name, flat=True))
+
+    for obj, slug in zip(objs, slugs):
+        original, index = slug, 1
+        while slug in used:
+            index += 1
+            end = '%s%s' % (sep, index)
+            slug = '%s%s' % (original[:field.max_length - len(end)], end)
+        used.add(slug)
+        setattr(obj, field.attname, slug)
+        obj._allocated_slug = slug
+    return objs
+
+
+_slug_caches = {}
+_slug_caches_lock = threading.Lock()
+
+
+def _get_slug_cache(model):
+    with _slug_caches_lock:
+        if model not in _slug_caches:
+            _slug_caches[model] = LRUCache(model.slug_cache_size, model.slug_cache_timeout)
+            uid = 'helpers.models.slug_cache.%s' % model._meta.label_lower
+            post_save.connect(_clear_slug_cache, sender=model, dispatch_uid=uid)
+            post_delete.connect(_clear_slug_cache, sender=model, dispatch_uid=uid)
+        return _slug_caches[model]
+
+
+def _clear_slug_cache(sender, instance, **kwargs):
+    slug_cache = _slug_caches.get(sender)
+    if slug_cache is None:
+        return
+    pk_index = [f.attname for f in sender._meta.concrete_fields].index(sender._meta.pk.attname)
+    slug_cache.delete_values(lambda row: row[1][pk_index] == instance.pk)
+
+
 class SlugTitleMixin(models.Model):
     """
     Добавляет title и slug от него
+        Для массового импорта: bulk_create(allocate_slugs(objs))
+        Для детальных страниц: get_by_slug_cached(slug)
     """
     title = models.CharField(verbose_name='Название', max_length=255, db_index=True)
-    slug = AutoSlugField(populate_from='title', unique=True, editable=True, db_index=True,
+    slug = BulkAutoSlugField(populate_from='title', unique=True, editable=True, db_index=True,
                          blank=True, help_text='Если оставить пустым - заполнится автоматом',
                          max_length=255,)
 
+    slug_cache_size = 1000
+    slug_cache_timeout = 60
+
     class Meta:
         abstract = True
         ordering = ['title']
 
+    @classmethod
+    def get_by_slug_cached(cls, slug):
+        """
+        Объект по slug из LRU кеша процесса, при попадании без запроса в БД
+            Запись сбрасывается при сохранении / удалении объекта в этом
+            процессе, изменения из других процессов видны через
+            slug_cache_timeout секунд. Если объекта нет - DoesNotExist
+        """
+        slug_cache = _get_slug_cache(cls)
+        db = router.db_for_read(cls)
+        row = slug_cache.get(slug)
+        if row is None:
+            field_names = [f.attname for f in cls._meta.concrete_fields]
+            values = cls._default_manager.using(db).filter(slug=slug).values_list(
+                *field_names).first()
+            if values is None:
+                raise cls.DoesNotExist('%s matching slug %r does not exist.' % (
+                    cls._meta.object_name, slug))
+            row = (field_names, values)
+            slug_cache.set(slug, row)
+        # сырая строка из БД, копия - чтобы объекты не делили изменяемые значения
+        return cls.from_db(db, row[0], deepcopy(row[1]))
+
     def __str__(self):
         return self.title
 
@@ -165,6 +498,8 @@ class LastUpdateMixin(models.Model):
 class LastUpdateManualMixin(models.Model):
     """
     Последнее обновление, обновляется вручную
+        update_last_update() у сохраненного объекта записывает
+        только last_update
     """
     last_update = models.DateTimeField(verbose_name='Последнее обновление', blank=True,
                                        db_index=True)
@@ -180,19 +515,170 @@ class LastUpdateManualMixin(models.Model):
     def update_last_update(self, commit=True):
         self.last_update = datetime.now()
         if commit:
-            self.save()
+            if self._state.adding or self.pk is None:
+                self.save()
+            else:
+                self.save(update_fields=['last_update'])
+
+
+_DEFERRED = object()
 
 
-class ImageMixin(models.Model):
+def _snapshot_value(value):
+    # FieldFile меняется на месте (image.save()), запоминаем имя файла
+    return value.name if isinstance(value, FieldFile) else value
+
+
+class DirtyFieldsMixin(models.Model):
+    """
+    Отслеживание измененных полей без дополнительных запросов
+        Значения полей запоминаются при загрузке и после сохранения
+
+        tracked_fields - отслеживаемые поля, None - все поля модели
+        save_dirty_fields_only - save() записывает только измененные
+            отслеживаемые поля (и поля с auto_now), если ничего не
+            изменилось - запроса не будет. Изменения в неотслеживаемых
+            полях в этом режиме не сохраняются
+
+    >>> product.has_changed('price')
+    >>> product.changed_fields
+    ['price', 'active']
+    """
+    tracked_fields = None
+    save_dirty_fields_only = False
+    # поля, которые отслеживают миксины независимо от tracked_fields
+    _required_tracked_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._snapshot_fields()
+
+    @classmethod
+    def _get_tracked_fields(cls):
+        if '_tracked_fields_cache' not in cls.__dict__:
+            fields = [f for f in cls._meta.concrete_fields if not f.primary_key]
+            if cls.tracked_fields is not None:
+                names = set(cls.tracked_fields)
+                for klass in cls.__mro__:
+                    names.update(klass.__dict__.get('_required_tracked_fields', ()))
+                fields = [f for f in fields if f.name in names]
+            cls._tracked_fields_cache = tuple((f.name, f.attname) for f in fields)
+        return cls._tracked_fields_cache
+
+    def _snapshot_fields(self, field_names=None):
+        values = self.__dict__
+        fields = self._get_tracked_fields()
+        if field_names is None:
+            self._field_snapshot = tuple(_snapshot_value(values.get(attname, _DEFERRED))
+                                         for _, attname in fields)
+            return
+        snapshot = list(self._field_snapshot)
+        for i, (name, attname) in enumerate(fields):
+            if name in field_names or attname in field_names:
+                snapshot[i] = _snapshot_value(values.get(attname, _DEFERRED))
+        self._field_snapshot = tuple(snapshot)
+
+    def _is_field_changed(self, attname, origin):
+        value = self.__dict__.get(attname, _DEFERRED)
+        return value is not _DEFERRED and value != origin
+
+    @property
+    def changed_fields(self):
+        """
+        Список измененных с момента загрузки полей
+        """
+        return [name for (name, attname), origin
+                in zip(self._get_tracked_fields(), self._field_snapshot)
+                if self._is_field_changed(attname, origin)]
+
+    def has_changed(self, field_name):
+        for (name, attname), origin in zip(self._get_tracked_fields(), self._field_snapshot):
+            if field_name in (name, attname):
+                return self._is_field_changed(attname, origin)
+        raise ValueError('Field %s is not tracked' % field_name)
+
+    def _get_field_origin(self, field_name):
+        """
+        Значение поля при загрузке или последнем сохранении,
+        _DEFERRED для отложенных полей
+        """
+        for (name, attname), origin in zip(self._get_tracked_fields(), self._field_snapshot):
+            if field_name in (name, attname):
+                return origin
+        raise ValueError('Field %s is not tracked' % field_name)
+
+    def save(self, *args, **kwargs):
+        if self.save_dirty_fields_only and not args and not self._state.adding and \
+                self.pk is not None and kwargs.get('update_fields') is None:
+            update_fields = self.changed_fields
+            if update_fields:
+                update_fields += [f.name for f in self._meta.concrete_fields
+                                  if getattr(f, 'auto_now', False) and f.name not in update_fields]
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        self._snapshot_fields(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot_fields(fields)
+
+
+class ImageMixin(DirtyFieldsMixin):
     """
     Картинка
+        image_renditions - уменьшенные копии, которые создаются в фоне
+            при сохранении нового изображения и лежат рядом с оригиналом
+            {'small': (200, 200), 'small_webp': (200, 200, 'WEBP')}
+            Копии замененного изображения удаляются, если оно больше
+            не используется другими объектами
+            Для уже загруженных: manage.py image_renditions app.Model
+
+    <img src="{{ object.image_urls.small_webp }}">
     """
     image = models.ImageField(verbose_name='Изображение', upload_to=generate_upload_name,
                               max_length=255)
 
+    image_renditions = None
+    tracked_fields = ()
+    _required_tracked_fields = ('image',)
+
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        origin = self._get_field_origin('image')
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        super().save(*args, **kwargs)
+        if not self.image_renditions or origin is _DEFERRED or \
+                (update_fields is not None and 'image' not in update_fields):
+            return
+        name = _snapshot_value(self.__dict__.get('image'))
+        if name == origin:
+            return
+        if origin and not adding:
+            run_in_background(delete_unused_renditions, self.__class__, 'image', origin,
+                              self.image_renditions)
+        if name:
+            run_in_background(generate_renditions, self.image.storage, name,
+                              self.image_renditions)
+
+    @property
+    def image_urls(self):
+        """
+        URL уменьшенных копий по ключам image_renditions
+        """
+        urls = {}
+        if not self.image:
+            return urls
+        for key, options in (self.image_renditions or {}).items():
+            name = get_rendition_name(self.image.name, key, parse_rendition(options)[2])
+            urls[key] = self.image.storage.url(name)
+        return urls
+
 
 class OldPriceMixin(models.Model):
     """
@@ -215,10 +701,12 @@ class PriceMixin(models.Model):
         abstract = True
 
 
-class YouTubeMixin(models.Model):
+class YouTubeMixin(DirtyFieldsMixin):
     """
     Добавляет поле для ссылки с youtube и метод, получающи id видео
-        При сохранении загружается превью видео
+        При сохранении превью видео загружается в фоне (helpers.tasks),
+        для уже сохраненных объектов: manage.py youtube_thumbnails
+        Отложенные (only / defer) поля при сохранении не загружаются
     """
     youtube_link = models.URLField(verbose_name='Ссылка на видео с youtube.com', blank=True,
                                    null=True, default=None)
@@ -227,32 +715,29 @@ class YouTubeMixin(models.Model):
                                           max_length=255, blank=True, null=True,
                                           default=None)
 
+    tracked_fields = ()
+    _required_tracked_fields = ('youtube_link',)
+
     class Meta:
         abstract = True
 
     @property
     def youtube_id(self):
-        if self.youtube_link and '?v=' in self.youtube_link:
-            return self.youtube_link.split('?v=')[1]
+        return get_youtube_id(self.youtube_link)
 
     def save(self, *args, **kwargs):
-        origin = None
-        if self.pk:
-            origin = self.__class__.objects.get(pk=self.pk)
+        link_changed = self.has_changed('youtube_link')
+        update_fields = kwargs.get('update_fields')
         super().save(*args, **kwargs)
-        if origin and origin.youtube_link != self.youtube_link:
-            self._update_youtube_thumbnail()
-        elif not self.youtube_thumbnail and self.youtube_id:
-            self._update_youtube_thumbnail()
+        link = self.__dict__.get('youtube_link')
+        if not get_youtube_id(link) or \
+                (update_fields is not None and 'youtube_link' not in update_fields):
+            return
+        if link_changed or ('youtube_thumbnail' in self.__dict__ and not self.youtube_thumbnail):
+            run_in_background(update_youtube_thumbnail, self, link)
 
     def _update_youtube_thumbnail(self):
-        image_response = requests.get(
-            'http://img.youtube.com/vi/%s/0.jpg' % self.youtube_id)
-        if image_response.status_code == 200:
-            self.youtube_thumbnail.save(
-                '%s.jpg' % self.youtube_id,
-                ContentFile(image_response.content)
-            )
+        return update_youtube_thumbnail(self, self.youtube_link)
 
 
 class TextMixin(models.Model):
@@ -320,7 +805,7 @@ class RequiredEmailMixin(models.Model):
 class PhoneMixin(models.Model):
     """
     Добавляет не обязательное поле "Телефон"
-    TODO: добавить нормализацию поля
+        Нормализованный номер для поиска - NormalizedPhoneMixin
     """
     phone = models.CharField(verbose_name='Телефон', max_length=255, blank=True,
                              null=True, default=None)
@@ -332,7 +817,7 @@ class PhoneMixin(models.Model):
 class RequiredPhoneMixin(models.Model):
     """
     Добавляет не обязательное поле "Телефон"
-    TODO: добавить нормализацию поля
+        Нормализованный номер для поиска - NormalizedPhoneMixin
     """
     phone = models.CharField(verbose_name='Телефон', max_length=255)
 
@@ -340,6 +825,43 @@ class RequiredPhoneMixin(models.Model):
         abstract = True
 
 
+class NormalizedPhoneMixin(models.Model):
+    """
+    Индексированная колонка с нормализованным телефоном,
+    используется вместе с PhoneMixin / RequiredPhoneMixin
+        Заполняется при save(), для bulk_create - fill_normalized_phones()
+
+    class Customer(NormalizedPhoneMixin, PhoneMixin):
+        pass
+
+    Customer.objects.filter(phone_normalized=normalize_phone(phone))
+    """
+    phone_normalized = models.CharField(verbose_name='Нормализованный телефон', max_length=32,
+                                        blank=True, null=True, default=None, editable=False,
+                                        db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone)[:32] if self.phone else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['phone_normalized']
+        super().save(*args, **kwargs)
+
+
+def fill_normalized_phones(objs):
+    """
+    Заполняет phone_normalized у объектов перед bulk_create
+    """
+    objs = list(objs)
+    normalized, _ = normalize_phones([obj.phone or None for obj in objs])
+    for obj, phone in zip(objs, normalized):
+        obj.phone_normalized = phone[:32] if phone else None
+    return objs
+
+
 try:
     from ckeditor_uploader.fields import RichTextUploadingField
 
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import json
+from collections.abc import Sequence
+from datetime import datetime
+
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(InvalidPage):
+    """
+    Курсор передан, но поврежден, подписан другим ключом
+    или выдан для другой сортировки
+    """
+    pass
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder обрезает микросекунды у datetime,
+    для курсора нужна полная точность
+    """
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer(object):
+    """
+    Сериализатор для django.core.signing
+    """
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), cls=CursorJSONEncoder).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+def get_queryset_ordering(queryset):
+    """
+    Возвращает итоговую сортировку queryset в виде списка
+    (поле, по убыванию) с учетом Meta.ordering и reverse()
+        В конец добавляется pk, чтобы сортировка была однозначной
+    """
+    query = queryset.query
+    ordering = []
+    for item in query.order_by or query.get_meta().ordering or []:
+        if not isinstance(item, str) or item == '?':
+            raise ImproperlyConfigured(
+                'Cursor pagination supports only field names in ordering, got %r' % item)
+        desc = item.startswith('-')
+        ordering.append((item.lstrip('-'), desc != (not query.standard_ordering)))
+
+    pk_name = queryset.model._meta.pk.name
+    if not any(name in ('pk', pk_name) for name, _ in ordering):
+        ordering.append(('pk', False))
+    return ordering
+
+
+class CursorPage(Sequence):
+    """
+    Страница курсорной паджинации
+    """
+    def __init__(self, object_list, next_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def __repr__(self):
+        return '<CursorPage %s objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class CursorPaginator(object):
+    """
+    Паджинация по курсору (keyset)
+        Вместо COUNT(*) и OFFSET страница выбирается условием
+        "после последнего объекта предыдущей страницы" по полям
+        сортировки queryset, поэтому время выборки не зависит от
+        номера страницы. Курсор подписан и непрозрачен для клиента.
+
+        Поля сортировки должны быть NOT NULL, для связей
+        используйте поле связанной модели: brand__title
+    """
+    salt = 'helpers.pagination.CursorPaginator'
+
+    def __init__(self, queryset, per_page):
+        self.per_page = int(per_page)
+        self.ordering = get_queryset_ordering(queryset)
+        self.object_list = queryset.order_by(
+            *['%s%s' % ('-' if desc else '', name) for name, desc in self.ordering])
+        if not self.object_list.query.standard_ordering:
+            self.object_list = self.object_list.reverse()
+
+    def page(self, cursor=None):
+        queryset = self.object_list
+        values = self.decode_cursor(cursor)
+        if values is not None:
+            queryset = queryset.filter(self._get_keyset_query(values))
+
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(self._get_values(object_list[-1]))
+        return CursorPage(object_list, next_cursor, self)
+
+    def encode_cursor(self, values):
+        return signing.dumps(
+            {'o': self._ordering_key, 'v': values},
+            salt=self.salt, serializer=CursorSerializer, compress=True
+        )
+
+    def decode_cursor(self, cursor):
+        """
+        Значения полей сортировки из курсора или None для первой
+        страницы, если курсор не передан
+            InvalidCursor - курсор поврежден, подписан другим ключом
+            или выдан для другой сортировки
+        """
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=self.salt, serializer=CursorSerializer)
+        except (signing.BadSignature, ValueError):
+            raise InvalidCursor('Invalid cursor')
+        if not isinstance(data, dict) or data.get('o') != self._ordering_key or \
+                len(data.get('v', ())) != len(self.ordering):
+            raise InvalidCursor('Cursor does not match ordering')
+        return data['v']
+
+    @property
+    def _ordering_key(self):
+        return ['%s%s' % ('-' if desc else '', name) for name, desc in self.ordering]
+
+    def _get_keyset_query(self, values):
+        """
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+        """
+        query = None
+        equal = {}
+        for (name, desc), value in zip(self.ordering, values):
+            condition = Q(**dict(equal, **{'%s__%s' % (name, 'lt' if desc else 'gt'): value}))
+            query = condition if query is None else query | condition
+            equal[name] = value
+        return query
+
+    def _get_values(self, obj):
+        names = [name for name, _ in self.ordering]
+        if any('__' in name for name in names):
+            return list(self.object_list.filter(pk=obj.pk).values_list(*names)[0])
+
+        meta = obj._meta
+        values = []
+        for name in names:
+            if name == 'pk':
+                values.append(obj.pk)
+            else:
+                values.append(getattr(obj, meta.get_field(name).attname))
+        return values
@@ -1,6 +1,19 @@
 # -*- coding: utf-8 -*-
 import re
-from django.db.models import Q
+import threading
+from array import array
+from bisect import bisect_left, insort
+from functools import reduce
+from operator import and_, or_
+from time import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+from .cache import get_model_version, track_model_version
 
 
 def get_search_query(query_string, search_fields=None):
@@ -16,9 +29,15 @@ def get_search_query(query_string, search_fields=None):
     """
     if search_fields is None:
         search_fields = ['title']
+    return get_terms_query(normalize_query(query_string), search_fields)
+
 
+def get_terms_query(terms, search_fields):
+    """
+    Комбинация Q объектов для уже нормализованных слов
+    """
     query = None
-    for term in normalize_query(query_string):
+    for term in terms:
         or_query = None
 
         for field_name in search_fields:
@@ -44,3 +63,380 @@ def normalize_query(query_string):
     findterms = re.compile(r'"([^"]+)"|(\S+)').findall
     normspace = re.compile(r'\s{2,}').sub
     return [normspace(' ', (t[0] or t[1]).strip()).lower() for t in findterms(query_string)]
+
+
+class SearchBackend(object):
+    """
+    Базовый поисковый движок
+        search_fields - список полей модели
+
+    Использование:
+        backend = get_search_backend(['title', 'brand__title'])
+        queryset = backend.search(Product.objects.all(), 'поисковый запрос')
+    """
+    def __init__(self, search_fields=None):
+        self.search_fields = list(search_fields or ['title'])
+
+    def search(self, queryset, query_string):
+        terms = normalize_query(query_string)
+        if not terms:
+            return queryset
+        return self.filter(queryset, terms)
+
+    def filter(self, queryset, terms):
+        raise NotImplementedError()
+
+
+class IcontainsSearchBackend(SearchBackend):
+    """
+    Поиск через icontains по всем полям, работает на любой БД,
+    но без индекса сканирует таблицу целиком
+    """
+    def filter(self, queryset, terms):
+        return queryset.filter(get_terms_query(terms, self.search_fields))
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск PostgreSQL с ранжированием
+        config - конфигурация словаря: russian, english, simple
+        vector_field - поле SearchVectorField c GIN индексом, если
+            его нет, то вектор вычисляется по search_fields и индекс
+            должен быть построен по тому же выражению (get_search_vector)
+        rank - сортировать по релевантности (search_rank)
+    """
+    vendors = ('postgresql',)
+
+    def __init__(self, search_fields=None, config='russian', vector_field=None, rank=True):
+        super().__init__(search_fields)
+        self.config = config
+        self.vector_field = vector_field
+        self.rank = rank
+
+    def get_search_vector(self):
+        from django.contrib.postgres.search import SearchVector
+        if self.vector_field:
+            return F(self.vector_field)
+        return SearchVector(*self.search_fields, config=self.config)
+
+    def get_search_query(self, terms):
+        from django.contrib.postgres.search import SearchQuery
+        query = None
+        for term in terms:
+            q = SearchQuery(term, config=self.config,
+                            search_type='phrase' if ' ' in term else 'plain')
+            query = q if query is None else query & q
+        return query
+
+    def filter(self, queryset, terms):
+        from django.contrib.postgres.search import SearchRank
+        vector = self.get_search_vector()
+        query = self.get_search_query(terms)
+        if self.vector_field:
+            queryset = queryset.filter(**{self.vector_field: query})
+        else:
+            queryset = queryset.annotate(search_vector=vector).filter(search_vector=query)
+        if self.rank:
+            queryset = queryset.annotate(
+                search_rank=SearchRank(vector, query)).order_by('-search_rank')
+        return queryset
+
+
+class TrigramSearchBackend(SearchBackend):
+    """
+    Нечеткий поиск по триграммам (pg_trgm)
+        Использует GIN индекс gin_trgm_ops по полям из search_fields,
+        тот же индекс ускоряет и icontains
+        rank - сортировать по похожести (search_rank)
+    """
+    vendors = ('postgresql',)
+
+    def __init__(self, search_fields=None, rank=True):
+        super().__init__(search_fields)
+        self.rank = rank
+
+    def filter(self, queryset, terms):
+        from django.contrib.postgres.search import TrigramSimilarity
+        queryset = queryset.filter(reduce(and_, [
+            reduce(or_, [Q(**{'%s__trigram_similar' % field_name: term})
+                         for field_name in self.search_fields])
+            for term in terms
+        ]))
+        if self.rank:
+            query_string = ' '.join(terms)
+            similarities = [TrigramSimilarity(field_name, query_string)
+                            for field_name in self.search_fields]
+            rank = similarities[0] if len(similarities) == 1 else Greatest(*similarities)
+            queryset = queryset.annotate(search_rank=rank).order_by('-search_rank')
+        return queryset
+
+
+_tokenize = re.compile(r'\w+').findall
+
+
+def tokenize(text):
+    """
+    Разбивает текст на слова для индекса
+        >>> tokenize('Ёлочные  игрушки, 10шт.')
+        ['елочные', 'игрушки', '10шт']
+    """
+    return _tokenize(str(text).lower().replace('ё', 'е'))
+
+
+def _intersect(postings):
+    """
+    Пересечение отсортированных списков pk, начиная с самого короткого
+    """
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        size = len(posting)
+        matched = []
+        for pk in result:
+            i = bisect_left(posting, pk)
+            if i < size and posting[i] == pk:
+                matched.append(pk)
+        result = matched
+        if not result:
+            break
+    return list(result)
+
+
+class InvertedIndex(object):
+    """
+    Инвертированный индекс в памяти процесса: слово -> отсортированный
+    массив pk. Для небольших и средних таблиц на SQLite / MySQL
+        Строится при первом поиске, затем обновляется по сигналам
+        post_save / post_delete модели в этом процессе. Изменения из
+        других процессов (воркеры, админка, команды импорта) видны по
+        версии модели (helpers.cache): не чаще раза в check_interval
+        секунд версия сверяется, и при изменении индекс перестраивается.
+        Процессы, которые пишут данные, должны обновлять версию -
+        модель нужно указать в settings.HELPERS_CACHE_VERSION_MODELS.
+        Изменения в связанных моделях (brand__title) подхватываются
+        только после rebuild()
+        Модель должна иметь целочисленный pk
+
+    Использование:
+        index = get_search_index(Product, ['title', 'brand__title'])
+        Product.objects.filter(pk__in=index.search('ёлочн игрушк'))
+    """
+    check_interval = 5
+
+    def __init__(self, model, search_fields=None):
+        self.model = model
+        self.search_fields = list(search_fields or ['title'])
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+        self._built = False
+        self._version = None
+        self._checked_at = 0
+        # изменения, пришедшие во время rebuild()
+        self._pending = None
+
+        track_model_version(model)
+        uid = 'helpers.search.index.%s.%s' % (model._meta.label_lower,
+                                              ','.join(self.search_fields))
+        post_save.connect(self._post_save_receiver, sender=model,
+                          dispatch_uid=uid, weak=False)
+        post_delete.connect(self._post_delete_receiver, sender=model,
+                            dispatch_uid=uid, weak=False)
+
+    def rebuild(self):
+        with self._rebuild_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                version = get_model_version(self.model)
+                documents = {}
+                queryset = self.model._default_manager.values_list('pk', *self.search_fields)
+                for row in queryset.iterator():
+                    documents.setdefault(row[0], set()).update(self._get_tokens(row[1:]))
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+
+            postings = {}
+            for pk, tokens in documents.items():
+                for token in tokens:
+                    postings.setdefault(token, []).append(pk)
+
+            with self._lock:
+                self._documents = {pk: frozenset(tokens) for pk, tokens in documents.items()}
+                self._postings = {token: array('q', sorted(pks))
+                                  for token, pks in postings.items()}
+                self._tokens = sorted(self._postings)
+                pending, self._pending = self._pending, None
+                for pk, tokens in pending:
+                    self._remove(pk)
+                    if tokens is not None:
+                        self._add(pk, tokens)
+                self._version = version
+                self._checked_at = time()
+                self._built = True
+
+    def refresh(self):
+        """
+        Перестраивает индекс, если версия модели изменилась,
+        версия проверяется не чаще раза в check_interval секунд
+        """
+        if not self._built:
+            self.rebuild()
+            return
+        if time() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time()
+        if get_model_version(self.model) != self._version and \
+                not self._rebuild_lock.locked():
+            self.rebuild()
+
+    def search(self, query_string):
+        """
+        Список pk объектов, содержащих все слова запроса
+        (слово запроса совпадает с началом слова в тексте)
+        """
+        return self.search_terms(normalize_query(query_string))
+
+    def search_terms(self, terms):
+        self.refresh()
+        tokens = [token for term in terms for token in tokenize(term)]
+        if not tokens:
+            return []
+        with self._lock:
+            postings = []
+            for token in set(tokens):
+                posting = self._get_prefix_posting(token)
+                if not posting:
+                    return []
+                postings.append(posting)
+            return _intersect(postings)
+
+    def add(self, pk, values):
+        tokens = frozenset(self._get_tokens(values))
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, tokens)
+            if self._pending is not None:
+                self._pending.append((pk, tokens))
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+            if self._pending is not None:
+                self._pending.append((pk, None))
+
+    def _add(self, pk, tokens):
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                self._postings[token] = array('q', [pk])
+                insort(self._tokens, token)
+            else:
+                posting.insert(bisect_left(posting, pk), pk)
+        self._documents[pk] = tokens
+
+    def _remove(self, pk):
+        for token in self._documents.pop(pk, ()):
+            posting = self._postings[token]
+            i = bisect_left(posting, pk)
+            if i < len(posting) and posting[i] == pk:
+                del posting[i]
+            if not posting:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def _get_prefix_posting(self, prefix):
+        start = bisect_left(self._tokens, prefix)
+        end = start
+        while end < len(self._tokens) and self._tokens[end].startswith(prefix):
+            end += 1
+        if end - start == 1:
+            return self._postings[self._tokens[start]]
+        pks = set()
+        for token in self._tokens[start:end]:
+            pks.update(self._postings[token])
+        return sorted(pks)
+
+    def _get_tokens(self, values):
+        tokens = set()
+        for value in values:
+            if value is not None:
+                tokens.update(tokenize(value))
+        return tokens
+
+    def _post_save_receiver(self, sender, instance, **kwargs):
+        if any('__' in field_name for field_name in self.search_fields):
+            rows = self.model._default_manager.filter(pk=instance.pk).values_list(
+                *self.search_fields)
+            values = [value for row in rows for value in row]
+        else:
+            values = [getattr(instance, field_name) for field_name in self.search_fields]
+        self.add(instance.pk, values)
+
+    def _post_delete_receiver(self, sender, instance, **kwargs):
+        self.remove(instance.pk)
+
+
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+
+
+def get_search_index(model, search_fields=None):
+    """
+    Общий для процесса инвертированный индекс модели
+    """
+    key = (model, tuple(search_fields or ['title']))
+    with _search_indexes_lock:
+        if key not in _search_indexes:
+            _search_indexes[key] = InvertedIndex(model, search_fields)
+        return _search_indexes[key]
+
+
+class IndexSearchBackend(SearchBackend):
+    """
+    Поиск по InvertedIndex в памяти процесса, фильтр pk__in
+    """
+    def filter(self, queryset, terms):
+        index = get_search_index(queryset.model, self.search_fields)
+        return queryset.filter(pk__in=index.search_terms(terms))
+
+
+SEARCH_BACKENDS = {
+    'icontains': IcontainsSearchBackend,
+    'postgres': PostgresSearchBackend,
+    'trigram': TrigramSearchBackend,
+    'index': IndexSearchBackend,
+}
+
+
+def get_search_backend(search_fields=None, backend=None, **kwargs):
+    """
+    Возвращает поисковый движок
+        backend - имя из SEARCH_BACKENDS, путь до класса или класс,
+            по умолчанию settings.HELPERS_SEARCH_BACKEND или icontains
+    """
+    backend = backend or getattr(settings, 'HELPERS_SEARCH_BACKEND', 'icontains')
+    if isinstance(backend, str):
+        backend = SEARCH_BACKENDS.get(backend) or import_string(backend)
+    return backend(search_fields, **kwargs)
+
+
+def search(queryset, query_string, search_fields=None, backend=None, **kwargs):
+    """
+    Поиск по queryset выбранным движком
+        Если движок не поддерживает БД queryset (например postgres
+        на SQLite), используется icontains
+
+    Использование:
+        search(Product.objects.active(), 'поисковый запрос',
+               ['title', 'brand__title'], backend='postgres')
+    """
+    engine = get_search_backend(search_fields, backend, **kwargs)
+    vendors = getattr(engine, 'vendors', None)
+    if vendors and connections[queryset.db].vendor not in vendors:
+        engine = IcontainsSearchBackend(engine.search_fields)
+    return engine.search(queryset, query_string)
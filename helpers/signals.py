@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from django.dispatch import Signal
+
+# Отправляется после каждой пачки массового activate()/deactivate()/sync_active()
+#   sender - модель, pks - список измененных pk, active - новое значение
+active_changed = Signal()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Общий пул потоков для фоновых задач
+        settings.HELPERS_BACKGROUND_WORKERS - количество потоков
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'HELPERS_BACKGROUND_WORKERS', 4))
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %r failed', func)
+        raise
+    finally:
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Выполняет функцию в фоне после коммита текущей транзакции
+        settings.HELPERS_BACKGROUND_TASK - путь до функции
+            hook(func, *args, **kwargs), передающей задачу
+            в свою очередь (celery и т.п.)
+        settings.HELPERS_BACKGROUND_SYNC - выполнять сразу, для тестов
+    """
+    def submit():
+        if getattr(settings, 'HELPERS_BACKGROUND_SYNC', False):
+            func(*args, **kwargs)
+            return
+        hook = getattr(settings, 'HELPERS_BACKGROUND_TASK', None)
+        if hook:
+            import_string(hook)(func, *args, **kwargs)
+        else:
+            get_executor().submit(_run, func, args, kwargs)
+    transaction.on_commit(submit)
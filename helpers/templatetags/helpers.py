@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from django import template
-from helpers.utils import int_convertible, plural_number as _plural_number
+from helpers.utils import is_int_string, plural_number as _plural_number
 
 register = template.Library()
 
@@ -36,14 +36,10 @@ def wrap_1000(value, tag='span'):
     Обертывание в <tag>
     <tag>12</tag>345
     """
-    if int_convertible(value) and len(value) > 3:
-        first_part = value[:-3]
-        last_part = value[-3:]
-        return '<%(tag)s>%(first_part)s</%(tag)s>%(last_part)s' % {
-            'tag': tag,
-            'first_part': first_part,
-            'last_part': last_part
-        }
+    if isinstance(value, int):
+        value = str(value)
+    if is_int_string(value) and len(value) > 3:
+        return '<' + tag + '>' + value[:-3] + '</' + tag + '>' + value[-3:]
     else:
         return value
 
@@ -3,9 +3,13 @@ import random
 import string
 import re
 import os
-from hashlib import md5
+from functools import lru_cache
+from hashlib import md5, sha256
 from time import time
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.shortcuts import _get_queryset
 
 
@@ -25,6 +29,8 @@ def int_convertible(string):
     Проверяет можно ли преобразовать строку в целое число
     LOL: '100500'.isdigit() оО проверяет содержит ли строка только числа
     """
+    if isinstance(string, str) and string.isdecimal():
+        return True
     try:
         int(string)
         return True
@@ -32,6 +38,17 @@ def int_convertible(string):
         return False
 
 
+def is_int_string(value):
+    """
+    Строка из цифр с необязательным знаком, без исключений
+    """
+    if not isinstance(value, str):
+        return False
+    if value[:1] in ('-', '+'):
+        value = value[1:]
+    return value.isdecimal()
+
+
 def password_generator(size=6, chars=string.ascii_uppercase + string.digits):
     """
     Генератор пароля
@@ -50,22 +67,84 @@ def get_object_or_none(model, *args, **kwargs):
         return None
 
 
+@lru_cache(maxsize=256)
+def compile_text(text):
+    """
+    Split text once into segments between '#': every inner segment
+    is a possible #name# placeholder
+    """
+    return tuple(text.split('#'))
+
+
+def _replace_text_sequential(text, variables):
+    for name, value in variables.items():
+        text = text.replace('#%s#' % name, str(value))
+    return text
+
+
+def _render_text(text, segments, variables):
+    """
+    Single pass over segments, same result as sequential replace
+    of every #name#. Overlapping placeholders (#a#b#), names or values
+    with '#' and placeholders formed after replacement fall back to it
+    """
+    if any('#' in name for name in variables):
+        return _replace_text_sequential(text, variables)
+    last = len(segments) - 1
+    used = {i for i in range(1, last) if segments[i] in variables}
+    if not used:
+        return text
+    if any(i + 1 in used for i in used):
+        return _replace_text_sequential(text, variables)
+
+    result = [segments[0]]
+    for i in range(1, last + 1):
+        if i in used:
+            value = str(variables[segments[i]])
+            if '#' in value:
+                return _replace_text_sequential(text, variables)
+            result.append(value)
+        elif i - 1 in used:
+            result.append(segments[i])
+        else:
+            result.append('#')
+            result.append(segments[i])
+    result = ''.join(result)
+    if '#' in result and any('#%s#' % name in result for name in variables):
+        return _replace_text_sequential(text, variables)
+    return result
+
+
 def replace_text(text, variables):
     """
     Replace some special words in text to variable from dictionary
     @param text: raw text
     @param variables: dictionary of variables for replace
     """
-    for name, value in variables.items():
-        text = text.replace('#%s#' % name, str(value))
-    return text
+    return _render_text(text, compile_text(text), variables)
+
+
+def replace_text_many(text, variables_list):
+    """
+    Render one text against many dictionaries of variables
+    @param text: raw text
+    @param variables_list: iterable of dictionaries
+    """
+    segments = compile_text(text)
+    return [_render_text(text, segments, variables) for variables in variables_list]
+
+
+_phone_delete = str.maketrans('', '', ' \t\r\n\xa0+-()./\\,;:*#\u2010\u2011\u2012\u2013\u2014\u2212')
+_phone_non_word = re.compile(r'[\W]')
 
 
 def normalize_phone(phone):
     """
     Нормализует телефонный номер
     """
-    phone = re.sub(r'[\W]', '', phone)
+    phone = phone.translate(_phone_delete)
+    if not phone.isdigit():
+        phone = _phone_non_word.sub('', phone)
     if len(phone) == 10 and phone.startswith('9'):
         phone = '7' + phone
     if len(phone) == 11 and phone.startswith('8'):
@@ -73,21 +152,75 @@ def normalize_phone(phone):
     return phone
 
 
+def is_valid_phone(phone):
+    """
+    Проверяет нормализованный номер: только цифры, с кодом страны
+    """
+    return phone.isdigit() and 11 <= len(phone) <= 15
+
+
+def normalize_phones(phones):
+    """
+    Пакетная нормализация телефонов для импорта
+        Возвращает два списка: нормализованные номера и признаки
+        их корректности. None остается None
+    """
+    normalized = []
+    valid = []
+    for phone in phones:
+        if phone is None:
+            normalized.append(None)
+            valid.append(False)
+            continue
+        phone = normalize_phone(phone)
+        normalized.append(phone)
+        valid.append(is_valid_phone(phone))
+    return normalized, valid
+
+
+def _plural_index(n):
+    if n % 10 == 1 and n != 11:
+        return 0
+    if 2 <= n % 10 <= 4 and not 12 <= n <= 14:
+        return 1
+    return 2
+
+
+# Индекс формы слова по num % 100
+PLURAL_INDEXES = tuple(_plural_index(n) for n in range(100))
+
+
+@lru_cache(maxsize=256)
+def compile_plural_forms(string):
+    """
+    Разбирает строку форм товар__товара__товаров один раз
+    """
+    plurals = tuple(string.split('__'))
+    if len(plurals) < 3:
+        raise Exception('It must have three variants')
+    return plurals
+
+
 def plural_number(num, string):
     """
     Склоняет относительно числа
     товар__товара__товаров
+        1 товар, 3 товара, 5 товаров, 11 товаров, 22 товара, 111 товаров
     """
-    plurals = string.split('__')
-    if len(plurals) < 3:
-        raise Exception('It must have three variants')
+    plurals = compile_plural_forms(string)
     if not isinstance(num, int):
         raise Exception('It must be integer')
-    if num % 10 == 1:
-        return plurals[0]
-    if num in [2, 3, 4]:
-        return plurals[1]
-    return plurals[2]
+    return plurals[PLURAL_INDEXES[abs(num) % 100]]
+
+
+def get_sharded_path(instance, filename, prefix=None):
+    """
+    Путь <app_label>/<model_name>/[prefix/]ab/cd/abcd...
+    """
+    basedir = os.path.join(instance._meta.app_label, instance._meta.model_name)
+    if prefix:
+        basedir = os.path.join(basedir, prefix)
+    return os.path.join(basedir, filename[:2], filename[2:4], filename)
 
 
 def generate_upload_name(instance, filename, prefix=None, unique=False):
@@ -99,10 +232,36 @@ def generate_upload_name(instance, filename, prefix=None, unique=False):
     ext = os.path.splitext(filename)[1]
     name = str(instance.pk or '') + filename + (str(time()) if unique else '')
     filename = md5(name.encode('utf8')).hexdigest() + ext
-    basedir = os.path.join(instance._meta.app_label, instance._meta.model_name)
-    if prefix:
-        basedir = os.path.join(basedir, prefix)
-    return os.path.join(basedir, filename[:2], filename[2:4], filename)
+    return get_sharded_path(instance, filename, prefix)
+
+
+def file_content_hash(content, chunk_size=64 * 1024, length=40):
+    """
+    sha256 содержимого файла (первые length hex символов),
+    файл читается частями
+        md5 здесь не годится: по имени из хеша файл переиспользуется
+        без записи, а коллизии md5 можно подобрать
+    """
+    hasher = sha256()
+    if hasattr(content, 'chunks'):
+        chunks = content.chunks(chunk_size)
+    else:
+        content.seek(0)
+        chunks = iter(lambda: content.read(chunk_size), b'')
+    for chunk in chunks:
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()[:length]
+
+
+def generate_content_upload_name(instance, filename, content, prefix=None):
+    """
+    Путь загрузки по хешу содержимого: одинаковые файлы
+    получают одинаковый путь в той же структуре папок,
+    что и generate_upload_name
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return get_sharded_path(instance, file_content_hash(content) + ext, prefix)
 
 
 class Bunch(object):
@@ -114,3 +273,21 @@ class Bunch(object):
     def __init__(self, args):
         for key in args:
             setattr(self, key, args[key])
+
+
+def create_http_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """
+    requests.Session с пулом keep-alive соединений и повторами
+    запросов при ошибках соединения и 5xx ответах
+        После последнего повтора 5xx ответ возвращается как есть,
+        а не исключением
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=Retry(total=retries, backoff_factor=backoff_factor,
+                          status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -1,9 +1,19 @@
 # -*- coding: utf-8 -*-
 import base64
-from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+import binascii
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.contrib.auth import authenticate
 from django.core.paginator import Paginator, EmptyPage
+from django.db.models.signals import post_save, post_delete
 from django.template.loader import render_to_string
+from django.utils.crypto import salted_hmac
+from django.utils.http import urlencode
+from .cache import LRUCache, get_model_version, track_model_version
+from .fastjson import FastJsonResponse
+from .pagination import CursorPaginator, InvalidCursor
 
 
 class OrderedObjectListMixin(object):
@@ -14,8 +24,30 @@ class OrderedObjectListMixin(object):
             ('price', 'Сначала дешевые'),
             ('-price', 'Сначала дорогие'),
         )
+        order_by_tiebreaker - добавлять pk в конец сортировки,
+            чтобы порядок был стабильным при паджинации
+
+    Поля сортировки без индекса выводятся в manage.py check (helpers.W001)
     """
     order_by = None
+    order_by_tiebreaker = False
+
+    @classmethod
+    def get_order_by_options(cls):
+        """
+        Варианты сортировки, разобранные один раз для класса
+            {значение: (поля или None для default, reverse, (значение, название))}
+        """
+        if '_order_by_options' not in cls.__dict__:
+            options = {}
+            for value, name in cls.order_by or ():
+                field = value.replace('-', '')
+                if field == 'default':
+                    options[value] = (None, value.startswith('-'), (value, name))
+                else:
+                    options[value] = ((value,), False, (value, name))
+            cls._order_by_options = options
+        return cls._order_by_options
 
     def get_queryset(self):
         return self.get_ordered_queryset(super().get_queryset())
@@ -27,26 +59,26 @@ class OrderedObjectListMixin(object):
         return context
 
     def get_ordered_queryset(self, queryset):
-        ordering = self.request.GET.get('order_by')
-        asc = True
-        if ordering and ordering in dict(self.order_by):
-            asc = not ordering.startswith('-')
-            if not asc:
-                ordering = ordering.replace('-', '')
-            if ordering == 'default' and asc:
-                return queryset.order_by(*self.model._meta.ordering)
-            if ordering == 'default' and not asc:
-                return queryset.order_by(*self.model._meta.ordering).reverse()
-            queryset = queryset.order_by('{0}{1}'.format('-' if not asc else '', ordering))
-        return queryset
+        option = self.get_order_by_options().get(self.request.GET.get('order_by'))
+        if option is None:
+            return queryset
+        ordering, reverse, _ = option
+        ordering = list(queryset.model._meta.ordering if ordering is None else ordering)
+        if self.order_by_tiebreaker:
+            pk_name = queryset.model._meta.pk.name
+            if not any(field.lstrip('-') in ('pk', pk_name)
+                       for field in ordering if isinstance(field, str)):
+                ordering.append('pk')
+        queryset = queryset.order_by(*ordering)
+        return queryset.reverse() if reverse else queryset
 
     def get_current_order_by(self):
         """
         Возвращает текущее значение из списка self.order_by
         """
-        for value, name in self.order_by:
-            if value == self.request.GET.get('order_by'):
-                return (value, name)
+        option = self.get_order_by_options().get(self.request.GET.get('order_by'))
+        if option is not None:
+            return option[2]
         return self.order_by[0]
 
 
@@ -63,45 +95,151 @@ class AjaxObjectListMixin(object):
             задан, то не выводится в контекст
         _context_object_name - для жесткого переопределения
             названия переменной в шаблоне
+        ajax_cursor_pagination - курсорная паджинация вместо
+            номеров страниц, курсор следующей страницы в ответе.
+            paginator_template_name в этом режиме не используется,
+            вместо него cursor_paginator_template_name с контекстом
+            cursor (следующей страницы или None) и has_next
+        ajax_cache_timeout - время кеширования ответа в секундах,
+            None - без кеша. Кеш сбрасывается при сохранении или
+            удалении объектов модели и моделей из ajax_cache_models
+            (сигналы подключаются при объявлении view, для процессов
+            без view - settings.HELPERS_CACHE_VERSION_MODELS).
+            Кешируемые фрагменты общие для всех посетителей и рендерятся
+            без request (контекст-процессоры, csrf_token, user недоступны),
+            см. get_ajax_cache_vary
     """
     object_list_template_name = None
     paginator_template_name = None
+    cursor_paginator_template_name = None
     _context_object_name = None
+    ajax_cursor_pagination = False
+    ajax_cursor_param = 'ajax_cursor'
+    ajax_cache_timeout = None
+    ajax_cache_models = ()
+    ajax_cache_ignore_params = ('_',)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.ajax_cache_timeout is not None:
+            models = list(cls.ajax_cache_models)
+            if getattr(cls, 'model', None) is not None:
+                models.append(cls.model)
+            track_model_version(*models)
 
     def get_ajax_object_list_context_data(self, queryset=None):
         """
         Возвращающий определенную страницу паджинатора
         """
-        queryset = queryset or self.get_queryset()
+        if queryset is None:
+            queryset = self.get_queryset()
+        if self.ajax_cursor_pagination:
+            return self.get_ajax_cursor_context_data(queryset)
+
         page = self.request.GET.get('ajax_page')
         paginator = Paginator(queryset, self.paginate_by)
-        context_object_name = self._context_object_name or \
-            self.get_context_object_name(queryset)
 
         try:
             object_list = paginator.page(page)
         except EmptyPage:
             object_list = paginator.page(paginator.num_pages)
 
+        return self._render_ajax_object_list(
+            queryset, object_list, self.paginator_template_name,
+            {'paginator': paginator, 'page_obj': object_list}
+        )
+
+    def get_ajax_cursor_context_data(self, queryset):
+        """
+        Страница курсорной паджинации (ajax_cursor_pagination = True)
+            Без COUNT(*) и OFFSET, следующая страница запрашивается
+            по курсору из ответа: ?ajax_page&ajax_cursor=<cursor>
+            Для поврежденного или устаревшего курсора ответ 400
+        """
+        paginator = CursorPaginator(queryset, self.paginate_by)
+        object_list = paginator.page(self.request.GET.get(self.ajax_cursor_param))
+        context = self._render_ajax_object_list(
+            queryset, object_list, self.cursor_paginator_template_name,
+            {'cursor': object_list.next_cursor, 'has_next': object_list.has_next()}
+        )
+        context['cursor'] = object_list.next_cursor
+        return context
+
+    def _render_ajax_object_list(self, queryset, object_list, paginator_template_name=None,
+                                 paginator_context=None):
+        context_object_name = self._context_object_name or \
+            self.get_context_object_name(queryset)
+        request = self.get_ajax_render_request()
         context = {
             'state_last': not object_list.has_next(),
             'object_list': render_to_string(
                 self.object_list_template_name,
                 {context_object_name: object_list},
-                request=self.request
+                request=request
             )
         }
-        if self.paginator_template_name:
+        if paginator_template_name:
             context['paginator'] = render_to_string(
-                self.paginator_template_name,
-                {'paginator': paginator, 'page_obj': object_list},
-                request=self.request
-            )
+                paginator_template_name, paginator_context, request=request)
+        return context
+
+    def get_ajax_render_request(self):
+        """
+        request для рендеринга фрагментов: при общем для всех
+        посетителей кеше None, чтобы в кеш не попали чужой
+        csrf_token и данные пользователя
+        """
+        if self.ajax_cache_timeout is not None and not self.get_ajax_cache_vary():
+            return None
+        return self.request
+
+    def get_ajax_cache_vary(self):
+        """
+        Часть ключа кеша, зависящая от посетителя, по умолчанию пустая
+            Если вернуть непустое значение, кеш будет отдельным для
+            каждого значения, а фрагменты рендерятся с request:
+
+            def get_ajax_cache_vary(self):
+                return self.request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        """
+        return ''
+
+    def get_ajax_cache_key(self):
+        """
+        Ключ кеша: view, путь, GET параметры (страница, курсор,
+        сортировка, фильтры), get_ajax_cache_vary и версия данных моделей
+        """
+        models = [self.model or self.get_queryset().model] + list(self.ajax_cache_models)
+        track_model_version(*models)
+        params = sorted(
+            (key, value) for key in self.request.GET
+            if key not in self.ajax_cache_ignore_params
+            for value in self.request.GET.getlist(key)
+        )
+        raw = '%s.%s|%s|%s|%s|%s' % (
+            self.__class__.__module__, self.__class__.__name__,
+            self.request.path, urlencode(params), self.get_ajax_cache_vary(),
+            get_model_version(*models)
+        )
+        return 'helpers:ajax_object_list:%s' % md5(raw.encode('utf8')).hexdigest()
+
+    def get_cached_ajax_object_list_context_data(self):
+        if self.ajax_cache_timeout is None:
+            return self.get_ajax_object_list_context_data()
+        key = self.get_ajax_cache_key()
+        context = cache.get(key)
+        if context is None:
+            context = self.get_ajax_object_list_context_data()
+            cache.set(key, context, self.ajax_cache_timeout)
         return context
 
     def get(self, request, *args, **kwargs):
         if request.is_ajax() and 'ajax_page' in request.GET:
-            return JsonResponse(self.get_ajax_object_list_context_data())
+            try:
+                context = self.get_cached_ajax_object_list_context_data()
+            except InvalidCursor:
+                return HttpResponseBadRequest()
+            return FastJsonResponse(context, request=request)
         return super().get(request, *args, **kwargs)
 
 
@@ -121,15 +259,15 @@ class AjaxFormViewMixin(object):
     def post(self, request, *args, **kwargs):
         if request.is_ajax():
             form = self.get_form(request.POST)
+            success = form.is_valid()
             context = {
-                'success': False,
+                'success': success,
                 'success_url': self.get_success_url(),
                 'error_keys': list(form.errors.keys())
             }
-            if form.is_valid():
+            if success:
                 self.form_valid(form)
-                context['success'] = True
-            return JsonResponse(context)
+            return FastJsonResponse(context, request=request)
         return HttpResponseBadRequest()
 
     def form_valid(self, form):
@@ -158,6 +296,66 @@ class BreadcrumbsMixin(object):
         return context
 
 
+BASICAUTH_CACHE_TIMEOUT = getattr(settings, 'HELPERS_BASICAUTH_CACHE_TIMEOUT', 60)
+BASICAUTH_MAX_FAILURES = getattr(settings, 'HELPERS_BASICAUTH_MAX_FAILURES', 10)
+BASICAUTH_FAILURE_WINDOW = getattr(settings, 'HELPERS_BASICAUTH_FAILURE_WINDOW', 300)
+
+# HMAC заголовка Authorization -> pk пользователя, пароли не хранятся
+_basicauth_cache = LRUCache(1000, BASICAUTH_CACHE_TIMEOUT)
+# (ip, логин) -> количество неудачных попыток, считается в памяти каждого
+# процесса, поэтому общий предел - BASICAUTH_MAX_FAILURES * число воркеров
+_basicauth_failures = LRUCache(10000, BASICAUTH_FAILURE_WINDOW)
+
+
+def _clear_basicauth_cache(sender, instance, **kwargs):
+    _basicauth_cache.delete_values(lambda pk: pk == instance.pk)
+
+
+post_save.connect(_clear_basicauth_cache, sender=settings.AUTH_USER_MODEL,
+                  dispatch_uid='helpers.views.basicauth')
+post_delete.connect(_clear_basicauth_cache, sender=settings.AUTH_USER_MODEL,
+                    dispatch_uid='helpers.views.basicauth')
+
+
+def _basicauth(credentials, request):
+    """
+    Проверяет base64 логин:пароль, результат успешной проверки
+    кешируется на BASICAUTH_CACHE_TIMEOUT секунд или до изменения
+    пользователя, неудачные попытки ограничиваются по ip и логину
+    (в пределах процесса) и сбрасываются после успешного входа
+    """
+    key = salted_hmac('helpers.views.basicauth', credentials).hexdigest()
+    if _basicauth_cache.get(key) is not None:
+        return True
+
+    try:
+        uname, passwd = base64.b64decode(credentials).decode('utf8').split(':', 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return False
+
+    failure_key = (request.META.get('REMOTE_ADDR'), uname)
+    failures = _basicauth_failures.get(failure_key, 0)
+    if failures >= BASICAUTH_MAX_FAILURES:
+        return False
+
+    user = authenticate(username=uname, password=passwd)
+    if user is not None and user.is_active and user.is_staff:
+        _basicauth_cache.set(key, user.pk)
+        if failures:
+            _basicauth_failures.delete(failure_key)
+        return True
+    _basicauth_failures.set(failure_key, failures + 1)
+    return False
+
+
+class BasicAuthMixin(object):
+    """
+    HTTP авторизация для class based view, аналог декоратора basicauth
+    """
+    def dispatch(self, request, *args, **kwargs):
+        return view_or_basicauth(super().dispatch, request, *args, **kwargs)
+
+
 def view_or_basicauth(view, request, *args, **kwargs):
     """
     Авторизует пользователя через HTTP
@@ -166,9 +364,7 @@ def view_or_basicauth(view, request, *args, **kwargs):
         auth = request.META['HTTP_AUTHORIZATION'].split()
         if len(auth) == 2:
             if auth[0].lower() == "basic":
-                uname, passwd = base64.b64decode(auth[1]).decode('utf8').split(':')
-                user = authenticate(username=uname, password=passwd)
-                if user is not None and user.is_active and user.is_staff:
+                if _basicauth(auth[1], request):
                     return view(request, *args, **kwargs)
 
     response = HttpResponse()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from .utils import create_http_session
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_URL = 'http://img.youtube.com/vi/%s/0.jpg'
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Сессия с пулом соединений, своя для каждого потока
+    """
+    if not hasattr(_local, 'session'):
+        _local.session = create_http_session()
+    return _local.session
+
+
+def get_youtube_id(youtube_link):
+    if youtube_link and '?v=' in youtube_link:
+        return youtube_link.split('?v=')[1]
+
+
+def fetch_youtube_thumbnail(youtube_id, timeout=10):
+    """
+    Содержимое превью видео или None
+    """
+    response = get_session().get(THUMBNAIL_URL % youtube_id, timeout=timeout)
+    if response.status_code == 200:
+        return response.content
+
+
+def update_youtube_thumbnail(instance, youtube_link):
+    """
+    Загружает превью и записывает только поле youtube_thumbnail,
+    если ссылка на видео за это время не изменилась
+        Поле обновляется и у instance, чтобы последующий save()
+        не затер превью
+    """
+    youtube_id = get_youtube_id(youtube_link)
+    if not youtube_id:
+        return False
+    content = fetch_youtube_thumbnail(youtube_id)
+    if content is None:
+        return False
+
+    field = instance._meta.get_field('youtube_thumbnail')
+    name = field.storage.save(
+        field.generate_filename(instance, '%s.jpg' % youtube_id),
+        ContentFile(content)
+    )
+    updated = instance.__class__._default_manager.filter(
+        pk=instance.pk, youtube_link=youtube_link
+    ).update(youtube_thumbnail=name)
+    if not updated:
+        field.storage.delete(name)
+        return False
+    instance.youtube_thumbnail = name
+    return True
+
+
+def _backfill_youtube_thumbnail(instance):
+    try:
+        return update_youtube_thumbnail(instance, instance.youtube_link)
+    except Exception:
+        logger.exception('Failed to update youtube thumbnail for %r (pk=%s)',
+                         instance.youtube_link, instance.pk)
+        return None
+
+
+def backfill_youtube_thumbnails(queryset, workers=8, force=False):
+    """
+    Параллельно загружает превью для объектов queryset,
+    у которых оно не заполнено (или для всех, если force)
+        Ошибки отдельных объектов пишутся в лог и не прерывают загрузку
+        Возвращает (количество обновленных объектов, количество ошибок)
+    """
+    queryset = queryset.exclude(Q(youtube_link__isnull=True) | Q(youtube_link=''))
+    if not force:
+        queryset = queryset.filter(Q(youtube_thumbnail__isnull=True) | Q(youtube_thumbnail=''))
+    instances = queryset.only('pk', 'youtube_link').iterator()
+
+    updated = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_backfill_youtube_thumbnail, instances):
+            if result is None:
+                failed += 1
+            elif result:
+                updated += 1
+    return updated, failed
@@ -5,7 +5,8 @@ setup(
     version='0.1a',
     author='Derugin Anton',
     author_email='anton.derugin@gmail.com',
-    packages=['helpers', 'helpers/markup', 'helpers/templatetags'],
+    packages=['helpers', 'helpers/markup', 'helpers/templatetags',
+              'helpers/management', 'helpers/management/commands'],
     install_requires=[
         'requests',
         'python-slugify',